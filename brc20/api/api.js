@@ -553,6 +553,21 @@ app.get('/v1/brc20/get_hash_of_all_current_balances', async (request, response)
   }
 });
 
+// Spending txid recorded by the outpoint index of the indexer (OUTPOINT_INDEX=true), null if it is not there
+async function lookupSpendingTxFromIndex(block_height, prev_txid, prev_vout) {
+  try {
+    let query = `select t.spending_txid
+                from brc20_transfer_outpoints t
+                join brc20_outpoint_index_block_hashes h on h.block_height = t.spent_height
+                where t.outpoint = $1 and t.spent_height = $2;`
+    let res = await query_db(query, [prev_txid + ':' + parseInt(prev_vout), parseInt(block_height)])
+    if (res.rows.length == 0) return null
+    return res.rows[0].spending_txid
+  } catch (err) {
+    return null // no outpoint index tables, the block is scanned instead
+  }
+}
+
 // Utility to call the Python script for spending txid lookup
 async function lookupSpendingTx(block_height, prev_txid, prev_vout) {
   return new Promise((resolve, reject) => {
@@ -592,7 +607,8 @@ app.get('/v1/brc20/lookup_spending_tx', async (request, response) => {
     if (!block_height || !prev_txid || typeof prev_vout === 'undefined') {
       return response.status(400).send({ error: 'Missing required parameters: block_height, prev_txid, prev_vout', result: null });
     }
-    const result = await lookupSpendingTx(block_height, prev_txid, prev_vout);
+    const spending_txid = await lookupSpendingTxFromIndex(block_height, prev_txid, prev_vout);
+    const result = spending_txid !== null ? { spending_txid } : await lookupSpendingTx(block_height, prev_txid, prev_vout);
     response.send({ error: null, result });
   } catch (err) {
     console.log(err);
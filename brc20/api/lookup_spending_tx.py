@@ -6,6 +6,10 @@ import argparse
 from bitcoinrpc.authproxy import AuthServiceProxy, JSONRPCException
 from dotenv import load_dotenv
 
+# raw block parser shared with the indexer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'psql'))
+from raw_block import RawBlock
+
 load_dotenv()
 
 parser = argparse.ArgumentParser(description='Lookup spending txid in a block')
@@ -26,20 +30,12 @@ rpc_url = f"{BITCOIN_RPC_SCHEME}://{BITCOIN_RPC_USER}:{BITCOIN_RPC_PASSWORD}@{BI
 try:
     rpc = AuthServiceProxy(rpc_url, timeout=30)
     block_hash = rpc.getblockhash(args.block_height)
-    block = rpc.getblock(block_hash)
-    txids = block['tx']
-    found = False
-    for txid in txids:
-        tx = rpc.getrawtransaction(txid, True)
-        vin = tx.get('vin', [])
-        for vin_item in vin:
-            if vin_item.get('txid') == args.prev_txid and vin_item.get('vout') == args.prev_vout:
-                print(json.dumps({'spending_txid': txid}))
-                found = True
-                break
-        if found:
-            break
-    if not found:
+    # One raw block instead of a getrawtransaction per transaction, only the spending tx is hashed
+    block = RawBlock(bytes.fromhex(rpc.getblock(block_hash, 0)))
+    spending_txid = block.find_spending_txids([(args.prev_txid, args.prev_vout)]).get((args.prev_txid, args.prev_vout))
+    if spending_txid is not None:
+        print(json.dumps({'spending_txid': spending_txid}))
+    else:
         print(json.dumps({'error': 'Spending txid not found in block'}))
         sys.exit(1)
 except JSONRPCException as e:
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+pkScript to address utilities for OPI-LC indexer
+Standard output scripts are matched by template and encoded directly, buidl is only used as a fallback
+"""
+
+import os
+import hashlib
+from functools import lru_cache
+
+import buidl
+from dotenv import load_dotenv
+
+# Load environment variables from .env
+load_dotenv()
+
+ADDRESS_CACHE_SIZE = int(os.getenv('ADDRESS_CACHE_SIZE', '200000'))
+
+B58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BECH32_CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+BECH32_CONST = 1
+BECH32M_CONST = 0x2bc830a3
+BECH32_GENERATOR = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+
+P2PKH_VERSION = b'\x00'
+P2SH_VERSION = b'\x05'
+SEGWIT_HRP = 'bc'
+
+B58_CHUNK = 58 ** 10
+
+def base58check_encode(payload):
+    """Encode bytes with a 4 byte double sha256 checksum in base58"""
+    data = payload + hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+    num = int.from_bytes(data, 'big')
+    res = []
+    ## divide by 58^10 so most of the work is done on small ints
+    while num > 0:
+        num, chunk = divmod(num, B58_CHUNK)
+        for _ in range(10):
+            chunk, rem = divmod(chunk, 58)
+            res.append(B58_ALPHABET[rem])
+    leading_zeros = len(data) - len(data.lstrip(b'\x00'))
+    return '1' * leading_zeros + ''.join(reversed(res)).lstrip('1')
+
+## xor of the generator values selected by the 5 top bits of the checksum
+BECH32_GENERATOR_TABLE = []
+for top in range(32):
+    value = 0
+    for i in range(5):
+        if (top >> i) & 1:
+            value ^= BECH32_GENERATOR[i]
+    BECH32_GENERATOR_TABLE.append(value)
+
+def bech32_polymod(values):
+    chk = 1
+    for value in values:
+        chk = ((chk & 0x1ffffff) << 5 ^ value) ^ BECH32_GENERATOR_TABLE[chk >> 25]
+    return chk
+
+def segwit_encode(hrp, witness_version, witness_program):
+    """Encode a segwit output as bech32 (v0) or bech32m (v1+)"""
+    bit_len = len(witness_program) * 8
+    group_count = (bit_len + 4) // 5
+    num = int.from_bytes(witness_program, 'big') << (group_count * 5 - bit_len)
+    data = [witness_version] + [(num >> (5 * i)) & 31 for i in range(group_count - 1, -1, -1)]
+    const = BECH32_CONST if witness_version == 0 else BECH32M_CONST
+    hrp_expanded = [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+    polymod = bech32_polymod(hrp_expanded + data + [0] * 6) ^ const
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + '1' + ''.join([BECH32_CHARSET[d] for d in data + checksum])
+
+def script_to_address_buidl(pkscript):
+    script = buidl.Script.parse(raw=bytearray.fromhex(pkscript))
+    if script.is_p2pkh():
+        return buidl.P2PKHScriptPubKey(script.commands[2]).address()
+    elif script.is_p2sh():
+        return buidl.P2SHScriptPubKey(script.commands[1]).address()
+    elif script.is_p2wpkh():
+        return buidl.P2WPKHScriptPubKey(script.commands[1]).address()
+    elif script.is_p2wsh():
+        return buidl.P2WSHScriptPubKey(script.commands[1]).address()
+    elif script.is_p2tr():
+        return buidl.P2TRScriptPubKey(script.commands[1]).address()
+    else:
+        return None
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def script_to_address(pkscript):
+    """
+    Convert a hex pkScript to its mainnet address
+
+    Args:
+        pkscript (str): hex encoded pkScript
+
+    Returns:
+        str: address for P2PKH/P2SH/P2WPKH/P2WSH/P2TR scripts, None otherwise
+    """
+    if pkscript is None:
+        return None
+    script = pkscript.lower()
+    script_len = len(script)
+    if script_len == 50 and script.startswith('76a914') and script.endswith('88ac'):
+        return base58check_encode(P2PKH_VERSION + bytes.fromhex(script[6:46]))
+    if script_len == 46 and script.startswith('a914') and script.endswith('87'):
+        return base58check_encode(P2SH_VERSION + bytes.fromhex(script[4:44]))
+    if script_len == 44 and script.startswith('0014'):
+        return segwit_encode(SEGWIT_HRP, 0, bytes.fromhex(script[4:]))
+    if script_len == 68 and script.startswith('0020'):
+        return segwit_encode(SEGWIT_HRP, 0, bytes.fromhex(script[4:]))
+    if script_len == 68 and script.startswith('5120'):
+        return segwit_encode(SEGWIT_HRP, 1, bytes.fromhex(script[4:]))
+    return script_to_address_buidl(pkscript)
+
+# Microbenchmark for development
+def benchmark_script_to_address(count=20000):
+    """Compare buidl decoding with the template fast path and the memoized path"""
+    import time
+    scripts = []
+    for i in range(count):
+        h = hashlib.sha256(str(i).encode()).hexdigest()
+        kind = i % 5
+        if kind == 0: scripts.append('76a914' + h[:40] + '88ac')
+        elif kind == 1: scripts.append('a914' + h[:40] + '87')
+        elif kind == 2: scripts.append('0014' + h[:40])
+        elif kind == 3: scripts.append('0020' + h)
+        else: scripts.append('5120' + h)
+
+    for s in scripts[:1000]:
+        assert script_to_address.__wrapped__(s) == script_to_address_buidl(s), s
+
+    sttm = time.time()
+    for s in scripts: script_to_address_buidl(s)
+    buidl_time = time.time() - sttm
+    sttm = time.time()
+    for s in scripts: script_to_address.__wrapped__(s)
+    fast_time = time.time() - sttm
+    script_to_address.cache_clear()
+    for s in scripts: script_to_address(s)
+    sttm = time.time()
+    for s in scripts: script_to_address(s)
+    cached_time = time.time() - sttm
+    print(f"{count} scripts - buidl: {buidl_time:.3f}s, fast path: {fast_time:.3f}s ({buidl_time / fast_time:.1f}x), "
+          f"memoized: {cached_time:.3f}s ({buidl_time / cached_time:.1f}x)")
+
+if __name__ == "__main__":
+    benchmark_script_to_address()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Bounded balance cache for OPI-LC indexer
+Holds the last (overall_balance, available_balance) of pkscript+tick keys with LRU eviction
+"""
+
+import sys
+from collections import OrderedDict
+
+OVERALL_BALANCE = 0
+AVAILABLE_BALANCE = 1
+
+# Approximate size of a cached record excluding the key:
+# the [overall, available] list, two medium sized ints and the OrderedDict entry/link
+RECORD_SIZE = sys.getsizeof([0, 0]) + 2 * sys.getsizeof(10 ** 30) + 104
+
+class BalanceCache:
+    """
+    LRU cache of balance records keyed by pkscript + tick.
+
+    Records are mutable [overall_balance, available_balance] lists that are updated
+    in place while a block is applied, so eviction only happens in trim(), which is
+    called after the block's changes are committed.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.records = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, key):
+        """Return the record for key or None, marking it as recently used"""
+        record = self.records.get(key)
+        if record is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.records.move_to_end(key)
+        return record
+
+    def put(self, key, overall_balance, available_balance):
+        """Insert a record and return it"""
+        record = [overall_balance, available_balance]
+        if key not in self.records:
+            self.bytes += sys.getsizeof(key) + RECORD_SIZE
+        self.records[key] = record
+        return record
+
+    def trim(self, protected=()):
+        """Evict least recently used records until the cache fits its byte budget, keys in protected are kept"""
+        skipped = 0
+        while self.bytes > self.max_bytes and len(self.records) > skipped:
+            key, record = self.records.popitem(last=False)
+            if key in protected:
+                ## not persisted yet, the db value is stale
+                self.records[key] = record
+                skipped += 1
+                continue
+            self.bytes -= sys.getsizeof(key) + RECORD_SIZE
+            self.evictions += 1
+
+    def clear(self):
+        self.records = OrderedDict()
+        self.bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = (100.0 * self.hits / total) if total > 0 else 0.0
+        return (f"entries: {len(self.records)}, approx size: {self.bytes // (1024 * 1024)}MB/{self.max_bytes // (1024 * 1024)}MB, "
+                f"hits: {self.hits}, misses: {self.misses} ({hit_rate:.1f}% hit), evictions: {self.evictions}")
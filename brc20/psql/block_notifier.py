@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+New block notifications for OPI-LC indexer
+Wakes the main loop as soon as a notification source reports a block, polling with a sleep stays as the fallback
+"""
+
+import os
+import sys
+import stat
+import time
+import threading
+import traceback
+
+try:
+    import zmq
+except ImportError:
+    zmq = None ## BLOCK_NOTIFY_ZMQ is ignored when pyzmq is not installed
+
+import requests
+
+SOURCE_RESTART_DELAY = 5
+FILE_POLL_INTERVAL = 0.25
+
+class BlockNotifier:
+    """
+    Sleeps of the main loop that end early when a source calls notify().
+
+    A source is a function run(notify) running on its own daemon thread, it is restarted
+    SOURCE_RESTART_DELAY seconds after it raises. Without sources wait() is a plain time.sleep().
+
+    A notification usually arrives before the OPI network has verified the block (bitcoind sees
+    it first), so for follow_up_time seconds after one, wait() keeps returning True every
+    follow_up_interval seconds until settle() is called once the new block is indexed.
+    """
+
+    def __init__(self, follow_up_time=60, follow_up_interval=1):
+        self.follow_up_time = follow_up_time
+        self.follow_up_interval = follow_up_interval
+        self.follow_up_until = 0
+        self.event = threading.Event()
+        self.sources = []
+        self.notifications = 0
+        self.last_source = None
+        self.last_ts = None
+
+    def __len__(self):
+        return len(self.sources)
+
+    def add_source(self, name, run):
+        thread = threading.Thread(target=self.run_source, args=(name, run), name='block-notify-' + name, daemon=True)
+        self.sources.append(name)
+        thread.start()
+
+    def run_source(self, name, run):
+        while True:
+            try:
+                run(lambda: self.notify(name))
+            except Exception:
+                traceback.print_exc()
+                print("Block notification source " + name + " failed, restarting in " + str(SOURCE_RESTART_DELAY) + "s")
+            time.sleep(SOURCE_RESTART_DELAY)
+
+    def notify(self, source):
+        self.notifications += 1
+        self.last_source = source
+        self.last_ts = time.time()
+        self.event.set()
+
+    def wait(self, timeout):
+        """
+        Sleep up to timeout seconds
+
+        Returns:
+            bool: True when woken by a notification or inside the follow-up window, cached chain heights should be refreshed
+        """
+        if len(self.sources) == 0:
+            time.sleep(timeout)
+            return False
+        following_up = time.time() < self.follow_up_until
+        if following_up: timeout = min(timeout, self.follow_up_interval)
+        woken = self.event.wait(timeout)
+        self.event.clear()
+        if woken:
+            self.follow_up_until = time.time() + self.follow_up_time
+            return True
+        return following_up
+
+    def settle(self):
+        """End the follow-up window, called when a new block is indexed"""
+        self.follow_up_until = 0
+
+    def stats(self):
+        if len(self.sources) == 0: return 'polling only'
+        return '%s, %d notifications, last from %s' % (', '.join(self.sources), self.notifications, self.last_source or '-')
+
+def zmq_source(endpoint, topic='hashblock'):
+    """bitcoind -zmqpubhashblock publisher, any message on topic is a new block"""
+    def run(notify):
+        socket = zmq.Context.instance().socket(zmq.SUB)
+        try:
+            socket.setsockopt(zmq.SUBSCRIBE, topic.encode('utf-8'))
+            socket.connect(endpoint)
+            while True:
+                socket.recv_multipart()
+                notify()
+        finally:
+            socket.close(linger=0)
+    return run
+
+def long_poll_source(http_client, url, hold_timeout=300):
+    """
+    HTTP long-poll, the server holds the GET until there is a new block and answers 200,
+    204 or 304 when nothing happened within its own hold time
+    """
+    def run(notify):
+        while True:
+            try:
+                r = http_client.get(url, 'block_notify_long_poll', timeout=(http_client.timeout[0], hold_timeout))
+            except requests.exceptions.ReadTimeout:
+                continue
+            if r.status_code == 200:
+                notify()
+            elif r.status_code not in (204, 304):
+                raise ValueError("long-poll status code " + str(r.status_code))
+    return run
+
+def file_source(path, poll_interval=FILE_POLL_INTERVAL):
+    """
+    Local trigger, e.g. bitcoind -blocknotify="touch path" or "echo > path".
+    Every write to a named pipe is a notification, a regular file notifies when its mtime changes.
+    """
+    def run(notify):
+        if os.path.exists(path) and stat.S_ISFIFO(os.stat(path).st_mode):
+            while True:
+                with open(path, 'rb', buffering=0) as f: ## blocks until a writer opens the pipe
+                    while f.read(4096):
+                        notify()
+        last_mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        while True:
+            time.sleep(poll_interval)
+            mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+            if mtime != last_mtime:
+                last_mtime = mtime
+                if mtime is not None: notify()
+    return run
+
+def create_block_notifier(http_client, zmq_endpoint='', long_poll_url='', trigger_file=''):
+    """BlockNotifier with a source for each configured setting, missing optional packages leave polling only"""
+    notifier = BlockNotifier()
+    if zmq_endpoint != '':
+        if zmq is None:
+            print("pyzmq is not installed, ignoring BLOCK_NOTIFY_ZMQ")
+        else:
+            notifier.add_source('zmq', zmq_source(zmq_endpoint))
+    if long_poll_url != '':
+        notifier.add_source('long-poll', long_poll_source(http_client, long_poll_url))
+    if trigger_file != '':
+        notifier.add_source('file', file_source(trigger_file))
+    return notifier
+
+# Stand-in publishers for development, measure how fast each source wakes a waiting loop
+def publish_zmq(endpoint, count, interval):
+    socket = zmq.Context.instance().socket(zmq.PUB)
+    socket.bind(endpoint)
+    time.sleep(0.5) ## let subscribers connect
+    for seq in range(count):
+        socket.send_multipart([b'hashblock', os.urandom(32), seq.to_bytes(4, 'little')])
+        time.sleep(interval)
+    socket.close(linger=0)
+
+def serve_long_poll(port, fire):
+    """Local long-poll endpoint answering 200 when fire is set, 204 after a 2 second hold"""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        def log_message(self, *args): pass
+        def do_GET(self):
+            code = 200 if fire.wait(2) else 204
+            fire.clear()
+            self.send_response(code)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def measure(notifier, publish, count=5, interval=0.5):
+    """Median seconds from publish() to the end of notifier.wait()"""
+    delays = []
+    for _ in range(count):
+        published = []
+        timer = threading.Timer(interval, lambda: (published.append(time.time()), publish()))
+        timer.start()
+        notifier.wait(10)
+        notifier.settle()
+        if published: delays.append(time.time() - published[0])
+        timer.join()
+    delays.sort()
+    return delays[len(delays) // 2]
+
+def benchmark_wake_latency():
+    import tempfile
+    from http_client import HttpClient
+    tmpdir = tempfile.mkdtemp()
+
+    fifo = os.path.join(tmpdir, 'blocknotify.fifo')
+    os.mkfifo(fifo)
+    def write_fifo():
+        with open(fifo, 'wb') as f: f.write(b'\n')
+    notifier = create_block_notifier(None, trigger_file=fifo)
+    print("file (named pipe): %.4fs" % measure(notifier, write_fifo))
+
+    touched = os.path.join(tmpdir, 'blocknotify')
+    def touch():
+        with open(touched, 'a'): os.utime(touched)
+    notifier = create_block_notifier(None, trigger_file=touched)
+    time.sleep(0.1)
+    print("file (mtime): %.4fs" % measure(notifier, touch))
+
+    fire = threading.Event()
+    server = serve_long_poll(0, fire)
+    notifier = create_block_notifier(HttpClient(), long_poll_url='http://127.0.0.1:%d/notify' % server.server_address[1])
+    print("long-poll: %.4fs" % measure(notifier, fire.set))
+    server.shutdown()
+
+    if zmq is not None:
+        endpoint = 'tcp://127.0.0.1:28399'
+        socket = zmq.Context.instance().socket(zmq.PUB)
+        socket.bind(endpoint)
+        notifier = create_block_notifier(None, zmq_endpoint=endpoint)
+        time.sleep(0.5)
+        print("zmq: %.4fs" % measure(notifier, lambda: socket.send_multipart([b'hashblock', os.urandom(32), b'\0\0\0\0'])))
+        socket.close(linger=0)
+
+    notifier = create_block_notifier(None)
+    sttm = time.time()
+    notifier.wait(5)
+    print("polling only: %.4fs" % (time.time() - sttm))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == 'publish-zmq':
+        ## stand-in for bitcoind -zmqpubhashblock, e.g. python block_notifier.py publish-zmq tcp://127.0.0.1:28332 10 5
+        publish_zmq(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 1, float(sys.argv[4]) if len(sys.argv) > 4 else 1)
+    else:
+        benchmark_wake_latency()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Lookahead block prefetcher for OPI-LC indexer
+Downloads the block info and events of the next blocks in a worker pool while the current block is indexed
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class BlockPrefetcher:
+    """
+    Keeps fetch_block(block_height) running for a window of blocks ahead of the block being indexed.
+
+    Results are handed out once by take(), in whatever order the caller asks for them.
+    Results older than max_age seconds are dropped so a block is never indexed with
+    hashes that are older than the OPI network cache would allow.
+    """
+
+    def __init__(self, fetch_block, window, workers, max_age):
+        self.fetch_block = fetch_block
+        self.window = window
+        self.max_age = max_age
+        self.futures = {} ## block_height -> Future of (fetch_ts, result)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch') if window > 0 and workers > 0 else None
+        self.hits = 0
+        self.misses = 0
+
+    def fetch(self, block_height):
+        result = self.fetch_block(block_height)
+        return time.time(), result
+
+    def schedule(self, current_block, max_block):
+        """Start fetching current_block .. current_block + window - 1, capped at max_block"""
+        if self.executor is None: return
+        with self.lock:
+            for block_height in [h for h in self.futures if h < current_block]:
+                self.futures.pop(block_height).cancel()
+            for block_height in range(current_block, min(current_block + self.window, max_block + 1)):
+                if block_height not in self.futures:
+                    self.futures[block_height] = self.executor.submit(self.fetch, block_height)
+
+    def take(self, block_height):
+        """Wait for and return the prefetched result of block_height, None if it was not prefetched or is too old"""
+        with self.lock:
+            future = self.futures.pop(block_height, None)
+        if future is None:
+            self.misses += 1
+            return None
+        fetch_ts, result = future.result()
+        if time.time() - fetch_ts > self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def invalidate(self):
+        """Drop every prefetched block, used when a reorg is detected"""
+        with self.lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures = {}
+
+    def stats(self):
+        return '%d in flight, %d hits, %d misses' % (len(self.futures), self.hits, self.misses)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Background block writer for OPI-LC indexer
+Verified block changesets are persisted by a dedicated thread with its own db connection while the next block is applied in memory
+"""
+
+import queue
+import threading
+import traceback
+
+class BlockChangeset:
+    """Every db change of a verified block, see the block changeset globals of brc20_light_client_psql.py for the row layouts"""
+    __slots__ = ('block_height', 'block_hash', 'block_event_hash', 'cumulative_event_hash',
+                 'events', 'balances', 'new_tickers', 'ticker_changes')
+
+    def __init__(self, block_height, block_hash, block_event_hash, cumulative_event_hash, events, balances, new_tickers, ticker_changes):
+        self.block_height = block_height
+        self.block_hash = block_hash
+        self.block_event_hash = block_event_hash
+        self.cumulative_event_hash = cumulative_event_hash
+        self.events = events
+        self.balances = balances
+        self.new_tickers = new_tickers
+        self.ticker_changes = ticker_changes
+
+class BlockWriter:
+    """
+    Persists block changesets in queue order with write_block(cur, changeset), one transaction per block.
+
+    put() blocks while max_pending changesets are waiting, which keeps the in-memory state at most
+    max_pending blocks ahead of the db. After a failed write every queued changeset is dropped so the
+    db stays a prefix of the verified blocks, the error is handed to the caller by take_error().
+    """
+
+    def __init__(self, connect, write_block, max_pending):
+        self.connect = connect
+        self.write_block = write_block
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.conn = None
+        self.error = None
+        self.persisted_height = None
+        self.thread = threading.Thread(target=self.run, name='block-writer', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            changeset = self.queue.get()
+            try:
+                if self.error is None:
+                    if self.conn is None or self.conn.closed:
+                        self.conn = self.connect()
+                    self.write_block(self.conn.cursor(), changeset)
+                    self.persisted_height = changeset.block_height
+            except Exception as e:
+                traceback.print_exc()
+                print("Error writing block " + str(changeset.block_height) + ", dropping queued blocks")
+                self.error = e
+                try:
+                    self.conn.cursor().execute('ROLLBACK;')
+                except Exception:
+                    try: self.conn.close()
+                    except Exception: pass
+                    self.conn = None
+            finally:
+                self.queue.task_done()
+
+    def put(self, changeset):
+        if self.error is not None:
+            raise RuntimeError("block writer failed: " + str(self.error))
+        self.queue.put(changeset)
+
+    def pending(self):
+        return self.queue.unfinished_tasks
+
+    def wait_idle(self):
+        """Wait until every queued changeset is persisted or dropped"""
+        self.queue.join()
+
+    def take_error(self):
+        error = self.error
+        self.error = None
+        return error
@@ -2,21 +2,35 @@
 # pip install psycopg2-binary
 # pip install buidl
 
-import os, sys, requests
+import os, sys
 from dotenv import load_dotenv
-import traceback, time, codecs, json, random
-import psycopg2
+import traceback, time, io, argparse
+import psycopg2, psycopg2.extras
 import hashlib
-import buidl
 
 # Import Bitcoin RPC utilities
-from bitcoin_rpc_utils import get_spending_txid_with_fallback, is_bitcoin_rpc_available
+from bitcoin_rpc_utils import get_spending_txid_with_fallback, is_bitcoin_rpc_available, spending_txid_index, bitcoin_rpc_stats, rpc_pool, set_spending_txid_store, USE_BITCOIN_RPC_FOR_TXID
+from balance_cache import BalanceCache, OVERALL_BALANCE, AVAILABLE_BALANCE
+from address_utils import script_to_address
+from event_records import DeployInscribeEvent, MintInscribeEvent, TransferInscribeEvent, TransferTransferEvent, EVENT_RECORD_TYPES
+from event_validation import validate_block, event_to_dict
+from event_archive import EventArchive
+from http_client import HttpClient
+from block_prefetcher import BlockPrefetcher
+from block_writer import BlockWriter, BlockChangeset
+from block_notifier import create_block_notifier
+from retry_scheduler import RetryScheduler, RetryPolicy
+from hash_reporter import HashReporter
+from event_providers import ProviderRegistry
+from json_stream import iter_json_array
+from chain_tip import ChainTip, BLOCK_HEIGHT, BLOCK_HASH, BLOCK_EVENT_HASH, CUMULATIVE_EVENT_HASH
+from outpoint_index import OutpointIndex
 
 ## global variables
 ticks = {}
-in_commit = False
-block_events_str = ""
+block_event_hasher = hashlib.sha256() ## streaming sha256 of the events of the current block joined by EVENT_SEPARATOR
 EVENT_SEPARATOR = "|"
+EVENT_SEPARATOR_BYTES = EVENT_SEPARATOR.encode('utf-8')
 CAN_BE_FIXED_DB_VERSIONS = [ 4 ]
 INDEXER_VERSION = "opi-brc20-light-client v0.3.1"
 DB_VERSION = 5
@@ -32,6 +46,10 @@ DEC2LONG = psycopg2.extensions.new_type(
     lambda value, curs: int(value) if value is not None else None)
 psycopg2.extensions.register_type(DEC2LONG)
 
+parser = argparse.ArgumentParser(description='OPI brc20 light client indexer')
+parser.add_argument('--replay-from-archive', action='store_true', help='rebuild the db from EVENT_ARCHIVE_DIR without network access and exit')
+args = parser.parse_args()
+
 ## load env variables
 load_dotenv()
 db_user = os.getenv("DB_USER") or "postgres"
@@ -43,21 +61,47 @@ db_password = os.getenv("DB_PASSWD")
 first_inscription_height = int(os.getenv("FIRST_INSCRIPTION_HEIGHT") or "767430")
 first_brc20_height = int(os.getenv("FIRST_BRC20_HEIGHT") or "779832")
 
+opi_api_url = (os.getenv("OPI_API_URL") or "https://api.opi.network").rstrip('/')
+
 report_to_indexer = (os.getenv("REPORT_TO_INDEXER") or "true") == "true"
-report_url = os.getenv("REPORT_URL") or "https://api.opi.network/report_block"
+report_url = os.getenv("REPORT_URL") or opi_api_url + "/report_block"
 report_retries = int(os.getenv("REPORT_RETRIES") or "10")
 report_name = os.getenv("REPORT_NAME") or "opi_brc20_light_client"
+report_state_file = os.getenv("REPORT_STATE_FILE") or "" ## keeps the unsent report across restarts, empty to disable
 
 create_extra_tables = (os.getenv("CREATE_EXTRA_TABLES") or "false") == "true"
 
+balance_cache_max_mb = int(os.getenv("BALANCE_CACHE_MAX_MB") or "1024")
+ticks_check_interval = int(os.getenv("TICKS_CHECK_INTERVAL") or "1000") ## verify in-memory ticks against brc20_tickers every N blocks, 0 to disable
+stats_interval = int(os.getenv("STATS_INTERVAL") or "100") ## print cache, network and worker stats every N blocks, 0 to disable
+prefetch_blocks = int(os.getenv("PREFETCH_BLOCKS") or "8") ## fetch events of up to N blocks ahead while indexing, 0 to disable
+prefetch_workers = int(os.getenv("PREFETCH_WORKERS") or "4")
+provider_max_inflight = int(os.getenv("PROVIDER_MAX_INFLIGHT") or "8") ## activity_on_block requests in flight over all providers, hedges included
+event_archive_dir = os.getenv("EVENT_ARCHIVE_DIR") or "" ## append verified blocks to a local archive, empty to disable
+block_notify_zmq = os.getenv("BLOCK_NOTIFY_ZMQ") or "" ## e.g. tcp://127.0.0.1:28332 of bitcoind -zmqpubhashblock
+block_notify_long_poll_url = os.getenv("BLOCK_NOTIFY_LONG_POLL_URL") or ""
+block_notify_file = os.getenv("BLOCK_NOTIFY_FILE") or "" ## named pipe or file touched by bitcoind -blocknotify
+block_writer_queue_size = max(1, int(os.getenv("BLOCK_WRITER_QUEUE_SIZE") or "4")) ## verified blocks waiting to be written while the next ones are applied
+outpoint_index_enabled = (os.getenv("OUTPOINT_INDEX") or "false") == "true" and USE_BITCOIN_RPC_FOR_TXID ## walk bitcoind blocks into brc20_transfer_outpoints in the background
+
+replay_from_archive_mode = args.replay_from_archive
+if replay_from_archive_mode and event_archive_dir == "":
+  print("EVENT_ARCHIVE_DIR must be set to replay from archive")
+  exit(1)
+event_archive = EventArchive(event_archive_dir) if event_archive_dir != "" else None
+
 ## connect to db
-conn = psycopg2.connect(
-  host=db_host,
-  port=db_port,
-  database=db_database,
-  user=db_user,
-  password=db_password)
-conn.autocommit = True
+def connect_db():
+  conn = psycopg2.connect(
+    host=db_host,
+    port=db_port,
+    database=db_database,
+    user=db_user,
+    password=db_password)
+  conn.autocommit = True
+  return conn
+
+conn = connect_db()
 cur = conn.cursor()
 
 ## create tables if not exists
@@ -80,142 +124,28 @@ if create_extra_tables:
       cur.execute(sql)
     conn.commit()
 
-## helper functions
-
-def utf8len(s):
-  return len(s.encode('utf-8'))
+if outpoint_index_enabled:
+  cur.execute('''SELECT EXISTS (SELECT 1 FROM pg_tables WHERE tablename = 'brc20_outpoint_index_block_hashes') AS table_existence;''')
+  if cur.fetchone()[0] == False:
+    print("Initialising outpoint index tables...")
+    with open('db_init_outpoint_index_psql.sql', 'r') as f:
+      sql = f.read()
+      cur.execute(sql)
+    conn.commit()
 
-def is_positive_number(s, do_strip=False):
-  try:
-    if do_strip:
-      s = s.strip()
-    try:
-      if len(s) == 0: return False
-      for ch in s:
-        if ord(ch) > ord('9') or ord(ch) < ord('0'):
-          return False
-      return True
-    except: return False
-  except: return False ## has to be a string
-
-def is_positive_number_with_dot(s, do_strip=False):
-  try:
-    if do_strip:
-      s = s.strip()
-    try:
-      dotFound = False
-      if len(s) == 0: return False
-      if s[0] == '.': return False
-      if s[-1] == '.': return False
-      for ch in s:
-        if ord(ch) > ord('9') or ord(ch) < ord('0'):
-          if ch != '.': return False
-          if dotFound: return False
-          dotFound = True
-      return True
-    except: return False
-  except: return False ## has to be a string
-
-def get_number_extended_to_18_decimals(s, decimals, do_strip=False):
-  if do_strip:
-    s = s.strip()
-  
-  if '.' in s:
-    normal_part = s.split('.')[0]
-    if len(s.split('.')[1]) > decimals or len(s.split('.')[1]) == 0: ## more decimal digit than allowed or no decimal digit after dot
-      return None
-    decimals_part = s.split('.')[1][:decimals]
-    decimals_part += '0' * (18 - len(decimals_part))
-    return int(normal_part + decimals_part)
-  else:
-    return int(s) * 10 ** 18
+## helper functions
 
 def is_used_or_invalid(inscription_id):
-  global event_types
-  cur.execute('''select coalesce(sum(case when event_type = %s then 1 else 0 end), 0) as inscr_cnt,
-                        coalesce(sum(case when event_type = %s then 1 else 0 end), 0) as transfer_cnt
-                        from brc20_events where inscription_id = %s;''', (event_types["transfer-inscribe"], event_types["transfer-transfer"], inscription_id,))
-  row = cur.fetchall()[0]
-  return (row[0] != 1) or (row[1] != 0)
-
-def fix_numstr_decimals(num_str, decimals):
-  if len(num_str) <= 18:
-    num_str = '0' * (18 - len(num_str)) + num_str
-    num_str = '0.' + num_str
-    if decimals < 18:
-      num_str = num_str[:-18+decimals]
-  else:
-    num_str = num_str[:-18] + '.' + num_str[-18:]
-    if decimals < 18:
-      num_str = num_str[:-18+decimals]
-  if num_str[-1] == '.': num_str = num_str[:-1] ## remove trailing dot
-  return num_str
-
-def script_to_address(pkscript):
-  if pkscript is None: return None
-  script = buidl.Script.parse(raw=bytearray.fromhex(pkscript))
-  if script.is_p2pkh():
-    return buidl.P2PKHScriptPubKey(script.commands[2]).address()
-  elif script.is_p2sh():
-    return buidl.P2SHScriptPubKey(script.commands[1]).address()
-  elif script.is_p2wpkh():
-    return buidl.P2WPKHScriptPubKey(script.commands[1]).address()
-  elif script.is_p2wsh():
-    return buidl.P2WSHScriptPubKey(script.commands[1]).address()
-  elif script.is_p2tr():
-    return buidl.P2TRScriptPubKey(script.commands[1]).address()
-  else:
-    return None
+  ## events of the current block are not flushed yet
+  if inscription_id in block_transfer_transfers: return True
+  if inscription_id in block_transfer_inscribes: return False
+  return inscription_id not in unused_transfer_inscribes
 
-def get_event_str(event, event_type, inscription_id):
+def get_event_str(record):
   global ticks
-  if event_type == "deploy-inscribe":
-    decimals_int = int(event["decimals"])
-    res = "deploy-inscribe;"
-    res += inscription_id + ";"
-    res += event["deployer_pkScript"] + ";"
-    res += event["tick"] + ";"
-    res += event["original_tick"] + ";"
-    res += fix_numstr_decimals(event["max_supply"], decimals_int) + ";"
-    res += event["decimals"] + ";"
-    res += fix_numstr_decimals(event["limit_per_mint"], decimals_int) + ";"
-    res += event["is_self_mint"]
-    return res
-  elif event_type == "mint-inscribe":
-    decimals_int = ticks[event["tick"]][2]
-    res = "mint-inscribe;"
-    res += inscription_id + ";"
-    res += event["minted_pkScript"] + ";"
-    res += event["tick"] + ";"
-    res += event["original_tick"] + ";"
-    res += fix_numstr_decimals(event["amount"], decimals_int) + ";"
-    res += event["parent_id"]
-    return res
-  elif event_type == "transfer-inscribe":
-    decimals_int = ticks[event["tick"]][2]
-    res = "transfer-inscribe;"
-    res += inscription_id + ";"
-    res += event["source_pkScript"] + ";"
-    res += event["tick"] + ";"
-    res += event["original_tick"] + ";"
-    res += fix_numstr_decimals(event["amount"], decimals_int)
-    return res
-  elif event_type == "transfer-transfer":
-    decimals_int = ticks[event["tick"]][2]
-    res = "transfer-transfer;"
-    res += inscription_id + ";"
-    res += event["source_pkScript"] + ";"
-    if event["spent_pkScript"] is not None:
-      res += event["spent_pkScript"] + ";"
-    else:
-      res += ";"
-    res += event["tick"] + ";"
-    res += event["original_tick"] + ";"
-    res += fix_numstr_decimals(event["amount"], decimals_int)
-    return res
-  else:
-    print("EVENT TYPE ERROR!!")
-    exit(1)
+  if record.event_type == "deploy-inscribe":
+    return record.get_event_str(record.decimals)
+  return record.get_event_str(ticks[record.tick][2])
 
 def get_sha256_hash(s):
   return hashlib.sha256(s.encode('utf-8')).hexdigest()
@@ -225,224 +155,335 @@ def get_sha256_hash(s):
 
 
 ## caches
-transfer_inscribe_event_cache = {} ## single use cache for transfer inscribe events
+## flushed transfer-inscribe events that are not transferred yet
+## inscription_id -> TransferInscribeEvent
+unused_transfer_inscribes = {}
+def load_unused_transfer_inscribes():
+  global unused_transfer_inscribes, event_types
+  sttm = time.time()
+  cur.execute('''select t.inscription_id, t.event->>'source_pkScript', t.event->>'source_wallet', t.event->>'tick', t.event->>'original_tick', t.event->>'amount'
+                 from brc20_events t
+                 where t.event_type = %s and not exists (
+                   select 1 from brc20_events t2 where t2.event_type = %s and t2.inscription_id = t.inscription_id
+                 );''', (event_types["transfer-inscribe"], event_types["transfer-transfer"]))
+  unused_transfer_inscribes = {}
+  for row in cur.fetchall():
+    unused_transfer_inscribes[row[0]] = TransferInscribeEvent(row[0], row[1], row[2], row[3], row[4], int(row[5]))
+  print("Loaded " + str(len(unused_transfer_inscribes)) + " unused transfer inscriptions in " + str(time.time() - sttm) + " seconds")
+
 def get_transfer_inscribe_event(inscription_id):
-  global transfer_inscribe_event_cache, event_types
-  if inscription_id in transfer_inscribe_event_cache:
-    event = transfer_inscribe_event_cache[inscription_id]
-    del transfer_inscribe_event_cache[inscription_id]
-    return event
-  cur.execute('''select event from brc20_events where event_type = %s and inscription_id = %s;''', (event_types["transfer-inscribe"], inscription_id,))
-  return cur.fetchall()[0][0]
-
-def save_transfer_inscribe_event(inscription_id, event):
-  transfer_inscribe_event_cache[inscription_id] = event
-
-balance_cache = {}
+  if inscription_id in block_transfer_inscribes:
+    return block_transfer_inscribes[inscription_id]
+  return unused_transfer_inscribes[inscription_id]
+
+def apply_block_transfer_changes():
+  ## called after the block changeset is verified and queued for writing
+  for inscription_id in block_transfer_inscribes:
+    unused_transfer_inscribes[inscription_id] = block_transfer_inscribes[inscription_id]
+  for inscription_id in block_transfer_transfers:
+    unused_transfer_inscribes.pop(inscription_id, None)
+
+balance_cache = BalanceCache(balance_cache_max_mb * 1024 * 1024)
 def get_last_balance(pkscript, tick):
-  global balance_cache
   cache_key = pkscript + tick
-  if cache_key in balance_cache:
-    return balance_cache[cache_key]
+  balance = balance_cache.get(cache_key)
+  if balance is not None:
+    return balance
   cur.execute('''select overall_balance, available_balance from brc20_historic_balances where pkscript = %s and tick = %s order by block_height desc, id desc limit 1;''', (pkscript, tick))
   row = cur.fetchone()
-  balance_obj = None
   if row is None:
-    balance_obj = {
-      "overall_balance": 0,
-      "available_balance": 0
-    }
-  else:
-    balance_obj = {
-      "overall_balance": row[0],
-      "available_balance": row[1]
-    }
-  balance_cache[cache_key] = balance_obj
-  return balance_obj
+    return balance_cache.put(cache_key, 0, 0)
+  return balance_cache.put(cache_key, row[0], row[1])
+
+def preload_balances(parsed_events):
+  ## loads the last balances of every (pkscript, tick) touched by the block's events in one query
+  pkscripts = []
+  tick_list = []
+  seen = set()
+  for event_type, tick, original_tick, values in parsed_events:
+    if event_type == 'deploy-inscribe': continue
+    ## values[1] is minted_pkScript or source_pkScript, values[2] is spent_pkScript for transfer-transfer
+    for pkscript in ((values[1], values[2]) if event_type == 'transfer-transfer' else (values[1],)):
+      if pkscript is None: continue
+      cache_key = pkscript + tick
+      if cache_key in balance_cache or cache_key in seen: continue
+      seen.add(cache_key)
+      pkscripts.append(pkscript)
+      tick_list.append(tick)
+  if len(pkscripts) == 0: return
+  cur.execute('''select k.pkscript, k.tick, b.overall_balance, b.available_balance
+                 from unnest(%s::text[], %s::text[]) as k(pkscript, tick)
+                 left join lateral (
+                   select overall_balance, available_balance
+                   from brc20_historic_balances hb
+                   where hb.pkscript = k.pkscript and hb.tick = k.tick
+                   order by hb.block_height desc, hb.id desc
+                   limit 1
+                 ) b on true;''', (pkscripts, tick_list))
+  for row in cur.fetchall():
+    balance_cache.put(row[0] + row[1], row[2] or 0, row[3] or 0)
 
 def check_available_balance(pkScript, tick, amount):
   last_balance = get_last_balance(pkScript, tick)
-  available_balance = last_balance["available_balance"]
+  available_balance = last_balance[AVAILABLE_BALANCE]
   if available_balance < amount: return False
   return True
 
 def reset_caches():
-  global balance_cache, transfer_inscribe_event_cache
-  balance_cache = {}
-  transfer_inscribe_event_cache = {}
+  balance_cache.clear()
 
-def deploy_inscribe(block_height, inscription_id, deployer_pkScript, deployer_wallet, tick, original_tick, max_supply, decimals, limit_per_mint, is_self_mint):
-  global ticks, in_commit, block_events_str, event_types
-  cur.execute("BEGIN;")
-  in_commit = True
-
-  event = {
-    "deployer_pkScript": deployer_pkScript,
-    "deployer_wallet": deployer_wallet,
-    "tick": tick,
-    "original_tick": original_tick,
-    "max_supply": str(max_supply),
-    "decimals": str(decimals),
-    "limit_per_mint": str(limit_per_mint),
-    "is_self_mint": str(is_self_mint)
-  }
-  block_events_str += get_event_str(event, "deploy-inscribe", inscription_id) + EVENT_SEPARATOR
-  cur.execute('''insert into brc20_events (event_type, block_height, inscription_id, event)
-    values (%s, %s, %s, %s);''', (event_types["deploy-inscribe"], block_height, inscription_id, json.dumps(event)))
-  
-  cur.execute('''insert into brc20_tickers (tick, original_tick, max_supply, decimals, limit_per_mint, remaining_supply, block_height, is_self_mint, deploy_inscription_id)
-    values (%s, %s, %s, %s, %s, %s, %s, %s, %s);''', (tick, original_tick, max_supply, decimals, limit_per_mint, max_supply, block_height, is_self_mint == "true", inscription_id))
-  
-  cur.execute("COMMIT;")
-  in_commit = False
-  ticks[tick] = [max_supply, limit_per_mint, decimals, is_self_mint == "true", inscription_id]
+## ticks are loaded once and kept in sync with brc20_tickers by deploy_inscribe, mint_inscribe, discard_block_changes and reorg_fix
+def load_ticks():
+  global ticks
+  sttm = time.time()
+  cur.execute('''select tick, remaining_supply, limit_per_mint, decimals, is_self_mint, deploy_inscription_id from brc20_tickers;''')
+  ticks_ = cur.fetchall()
+  ticks = {}
+  for t in ticks_:
+    ticks[t[0]] = [t[1], t[2], t[3], t[4], t[5]]
+  print("Ticks loaded in " + str(time.time() - sttm) + " seconds")
 
-def mint_inscribe(block_height, inscription_id, minted_pkScript, minted_wallet, tick, original_tick, amount, parent_id):
-  global ticks, in_commit, block_events_str, event_types
-  cur.execute("BEGIN;")
-  in_commit = True
-
-  event = {
-    "minted_pkScript": minted_pkScript,
-    "minted_wallet": minted_wallet,
-    "tick": tick,
-    "original_tick": original_tick,
-    "amount": str(amount),
-    "parent_id": parent_id
-  }
-  block_events_str += get_event_str(event, "mint-inscribe", inscription_id) + EVENT_SEPARATOR
-  cur.execute('''insert into brc20_events (event_type, block_height, inscription_id, event)
-    values (%s, %s, %s, %s) returning id;''', (event_types["mint-inscribe"], block_height, inscription_id, json.dumps(event)))
-  event_id = cur.fetchone()[0]
-  cur.execute('''update brc20_tickers set remaining_supply = remaining_supply - %s where tick = %s;''', (amount, tick))
-
-  last_balance = get_last_balance(minted_pkScript, tick)
-  last_balance["overall_balance"] += amount
-  last_balance["available_balance"] += amount
-  cur.execute('''insert into brc20_historic_balances (pkscript, wallet, tick, overall_balance, available_balance, block_height, event_id) 
-                values (%s, %s, %s, %s, %s, %s, %s);''', 
-                (minted_pkScript, minted_wallet, tick, last_balance["overall_balance"], last_balance["available_balance"], block_height, event_id))
-  
-  cur.execute("COMMIT;")
-  in_commit = False
-  ticks[tick][0] -= amount
+def get_ticks_checksum_str(tick):
+  t = ticks[tick]
+  return tick + ';' + str(t[0]) + ';' + str(t[1]) + ';' + str(t[2]) + ';' + ('true' if t[3] else 'false') + ';' + t[4]
+
+def verify_ticks():
+  sttm = time.time()
+  if not sync_block_writer(): return False
+  cur.execute('''select coalesce(md5(string_agg(tick || ';' || remaining_supply || ';' || limit_per_mint || ';' || decimals || ';' || is_self_mint || ';' || deploy_inscription_id, '|' order by tick collate "C")), md5(''))
+                 from brc20_tickers;''')
+  db_checksum = cur.fetchone()[0]
+  our_checksum = hashlib.md5('|'.join([get_ticks_checksum_str(tick) for tick in sorted(ticks)]).encode('utf-8')).hexdigest()
+  if db_checksum != our_checksum:
+    print("Ticks checksum mismatch!! reloading ticks from db")
+    load_ticks()
+    return False
+  print("Ticks verified in " + str(time.time() - sttm) + " seconds")
+  return True
 
-def transfer_inscribe(block_height, inscription_id, source_pkScript, source_wallet, tick, original_tick, amount):
-  global in_commit, block_events_str, event_types
+## block changeset
+## every change of a block is buffered here while the block is applied and written in a single transaction by flush_block_changes
+block_events = [] ## [event_type, inscription_id, event_json], event id is assigned on flush
+block_balances = [] ## [pkscript, wallet, tick, overall_balance, available_balance, event_idx, event_id_sign]
+block_new_tickers = [] ## [tick, original_tick, max_supply, decimals, limit_per_mint, remaining_supply, is_self_mint, deploy_inscription_id]
+block_ticker_changes = {} ## tick -> [minted_amount, burned_amount]
+block_transfer_inscribes = {} ## transfer-inscribe events in this block, same layout as unused_transfer_inscribes
+block_transfer_transfers = {} ## inscription id -> using_tx_id of transfer-transfer events in this block
+
+def clear_block_changes():
+  global block_events, block_balances, block_new_tickers, block_ticker_changes, block_transfer_inscribes, block_transfer_transfers
+  reset_block_event_hash()
+  block_events = []
+  block_balances = []
+  block_new_tickers = []
+  block_ticker_changes = {}
+  block_transfer_inscribes = {}
+  block_transfer_transfers = {}
+
+def discard_block_changes():
+  ## ticks and caches were already updated by the discarded changes
+  for tick in block_ticker_changes:
+    if tick in ticks:
+      ticks[tick][0] += block_ticker_changes[tick][0]
+  for t in block_new_tickers:
+    ticks.pop(t[0], None)
+  clear_block_changes()
+  ## the balance cache holds the only copy of balances of queued blocks, it can only be dropped once they are written
+  if sync_block_writer():
+    reset_caches()
+
+def reset_block_event_hash():
+  global block_event_hasher
+  block_event_hasher = hashlib.sha256()
+
+def update_block_event_hash(event_str, is_first):
+  if not is_first: block_event_hasher.update(EVENT_SEPARATOR_BYTES)
+  block_event_hasher.update(event_str.encode('utf-8'))
+
+def add_block_event(record):
+  update_block_event_hash(get_event_str(record), len(block_events) == 0)
+  block_events.append([event_types[record.event_type], record.inscription_id, record.to_json()])
+  return len(block_events) - 1
+
+def add_block_balance(pkscript, wallet, tick, balance, event_idx, event_id_sign=1):
+  block_balances.append([pkscript, wallet, tick, balance[OVERALL_BALANCE], balance[AVAILABLE_BALANCE], event_idx, event_id_sign])
+
+def add_block_ticker_change(tick, minted_amount, burned_amount):
+  if tick not in block_ticker_changes:
+    block_ticker_changes[tick] = [0, 0]
+  block_ticker_changes[tick][0] += minted_amount
+  block_ticker_changes[tick][1] += burned_amount
+
+def copy_escape(value):
+  if value is None: return '\\N'
+  return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def copy_rows(cur, table, columns, rows):
+  buf = io.StringIO()
+  for row in rows:
+    buf.write('\t'.join([copy_escape(v) for v in row]))
+    buf.write('\n')
+  buf.seek(0)
+  cur.copy_expert('COPY ' + table + ' (' + ', '.join(columns) + ') FROM STDIN;', buf)
+
+def write_block_changes(cur, changes):
+  ## runs on the block writer thread with its own connection, the block is persisted in a single transaction
+  block_height = changes.block_height
   cur.execute("BEGIN;")
-  in_commit = True
-
-  event = {
-    "source_pkScript": source_pkScript,
-    "source_wallet": source_wallet,
-    "tick": tick,
-    "original_tick": original_tick,
-    "amount": str(amount)
-  }
-  block_events_str += get_event_str(event, "transfer-inscribe", inscription_id) + EVENT_SEPARATOR
-  cur.execute('''insert into brc20_events (event_type, block_height, inscription_id, event)
-    values (%s, %s, %s, %s) returning id;''', (event_types["transfer-inscribe"], block_height, inscription_id, json.dumps(event)))
-  event_id = cur.fetchone()[0]
-  
-  last_balance = get_last_balance(source_pkScript, tick)
-  last_balance["available_balance"] -= amount
-  cur.execute('''insert into brc20_historic_balances (pkscript, wallet, tick, overall_balance, available_balance, block_height, event_id)
-                values (%s, %s, %s, %s, %s, %s, %s);''', 
-                (source_pkScript, source_wallet, tick, last_balance["overall_balance"], last_balance["available_balance"], block_height, event_id))
-  
+  if len(changes.events) > 0:
+    ## reserve a contiguous id range for the events of this block
+    cur.execute("""SELECT setval('brc20_events_id_seq', nextval('brc20_events_id_seq') + %s - 1);""", (len(changes.events),))
+    first_event_id = cur.fetchone()[0] - len(changes.events) + 1
+    copy_rows(cur, 'brc20_events', ('id', 'event_type', 'block_height', 'inscription_id', 'event'),
+              [(first_event_id + idx, e[0], block_height, e[1], e[2]) for idx, e in enumerate(changes.events)])
+    copy_rows(cur, 'brc20_historic_balances', ('pkscript', 'wallet', 'tick', 'overall_balance', 'available_balance', 'block_height', 'event_id'),
+              [(b[0], b[1], b[2], b[3], b[4], block_height, b[6] * (first_event_id + b[5])) for b in changes.balances])
+  if len(changes.new_tickers) > 0:
+    psycopg2.extras.execute_values(cur, '''insert into brc20_tickers (tick, original_tick, max_supply, decimals, limit_per_mint, remaining_supply, is_self_mint, deploy_inscription_id, block_height)
+      values %s;''', [t + [block_height] for t in changes.new_tickers], page_size=1000)
+  if len(changes.ticker_changes) > 0:
+    psycopg2.extras.execute_values(cur, '''update brc20_tickers t set remaining_supply = t.remaining_supply - v.minted_amount::numeric, burned_supply = t.burned_supply + v.burned_amount::numeric
+      from (values %s) as v(tick, minted_amount, burned_amount) where t.tick = v.tick;''', [(tick, c[0], c[1]) for tick, c in changes.ticker_changes.items()], page_size=1000)
+  cur.execute('''INSERT INTO brc20_cumulative_event_hashes (block_height, block_event_hash, cumulative_event_hash) VALUES (%s, %s, %s);''', (block_height, changes.block_event_hash, changes.cumulative_event_hash))
+  cur.execute('''INSERT INTO brc20_block_hashes (block_height, block_hash) VALUES (%s, %s);''', (block_height, changes.block_hash))
   cur.execute("COMMIT;")
-  in_commit = False
-  save_transfer_inscribe_event(inscription_id, event)
 
-def transfer_transfer_normal(block_height, inscription_id, spent_pkScript, spent_wallet, tick, original_tick, amount, using_tx_id):
-  global in_commit, block_events_str, event_types
-  cur.execute("BEGIN;")
-  in_commit = True
-
-  inscribe_event = get_transfer_inscribe_event(inscription_id)
-  source_pkScript = inscribe_event["source_pkScript"]
-  source_wallet = inscribe_event["source_wallet"]
-  event = {
-    "source_pkScript": source_pkScript,
-    "source_wallet": source_wallet,
-    "spent_pkScript": spent_pkScript,
-    "spent_wallet": spent_wallet,
-    "tick": tick,
-    "original_tick": original_tick,
-    "amount": str(amount),
-    "using_tx_id": str(using_tx_id)
-  }
-  block_events_str += get_event_str(event, "transfer-transfer", inscription_id) + EVENT_SEPARATOR
-  cur.execute('''insert into brc20_events (event_type, block_height, inscription_id, event)
-    values (%s, %s, %s, %s) returning id;''', (event_types["transfer-transfer"], block_height, inscription_id, json.dumps(event)))
-  event_id = cur.fetchone()[0]
-  
-  last_balance = get_last_balance(source_pkScript, tick)
-  last_balance["overall_balance"] -= amount
-  cur.execute('''insert into brc20_historic_balances (pkscript, wallet, tick, overall_balance, available_balance, block_height, event_id)
-                values (%s, %s, %s, %s, %s, %s, %s);''', 
-                (source_pkScript, source_wallet, tick, last_balance["overall_balance"], last_balance["available_balance"], block_height, event_id))
-  
-  if spent_pkScript != source_pkScript:
-    last_balance = get_last_balance(spent_pkScript, tick)
-  last_balance["overall_balance"] += amount
-  last_balance["available_balance"] += amount
-  cur.execute('''insert into brc20_historic_balances (pkscript, wallet, tick, overall_balance, available_balance, block_height, event_id) 
-                values (%s, %s, %s, %s, %s, %s, %s);''', 
-                (spent_pkScript, spent_wallet, tick, last_balance["overall_balance"], last_balance["available_balance"], block_height, -1 * event_id)) ## negated to make a unique event_id
-  
-  if spent_pkScript == '6a':
-    cur.execute('''update brc20_tickers set burned_supply = burned_supply + %s where tick = %s;''', (amount, tick))
+## verified blocks are written in order by a background thread, the db is always a prefix of the verified blocks
+block_writer = BlockWriter(connect_db, write_block_changes, block_writer_queue_size)
+block_writer_keys = [] ## [block_height, balance cache keys changed by the block] of queued blocks
+
+def sync_block_writer():
+  ## waits until every queued block is written, if a write failed the in-memory state is reloaded from the db
+  block_writer.wait_idle()
+  del block_writer_keys[:]
+  error = block_writer.take_error()
+  if error is not None:
+    print("Block writer failed, reloading state from db")
+    reload_state_from_db()
+    return False
+  return True
 
-  cur.execute("COMMIT;")
-  in_commit = False
+def trim_balance_cache():
+  ## balances of blocks that are not written yet must not be evicted
+  while len(block_writer_keys) > 0 and block_writer.persisted_height is not None and block_writer.persisted_height >= block_writer_keys[0][0]:
+    block_writer_keys.pop(0)
+  protected = set()
+  for _, keys in block_writer_keys:
+    protected.update(keys)
+  balance_cache.trim(protected)
+
+def flush_block_changes(block_height, block_hash, block_event_hash, cumulative_event_hash):
+  ## called only after the cumulative hash is verified, in-memory state moves on while the block is written in the background
+  block_writer.put(BlockChangeset(block_height, block_hash, block_event_hash, cumulative_event_hash,
+                                  block_events, block_balances, block_new_tickers, block_ticker_changes))
+  block_writer_keys.append([block_height, set([b[0] + b[2] for b in block_balances])])
+  chain_tip.append(block_height, block_hash, block_event_hash, cumulative_event_hash)
+  apply_block_transfer_changes()
+  clear_block_changes()
+
+def deploy_inscribe(record):
+  global ticks
+  add_block_event(record)
+  block_new_tickers.append([record.tick, record.original_tick, record.max_supply, record.decimals, record.limit_per_mint, record.max_supply, record.is_self_mint == "true", record.inscription_id])
+  ticks[record.tick] = [record.max_supply, record.limit_per_mint, record.decimals, record.is_self_mint == "true", record.inscription_id]
 
-def transfer_transfer_spend_to_fee(block_height, inscription_id, tick, original_tick, amount, using_tx_id):
-  global in_commit, block_events_str, event_types
-  cur.execute("BEGIN;")
-  in_commit = True
-
-  inscribe_event = get_transfer_inscribe_event(inscription_id)
-  source_pkScript = inscribe_event["source_pkScript"]
-  source_wallet = inscribe_event["source_wallet"]
-  event = {
-    "source_pkScript": source_pkScript,
-    "source_wallet": source_wallet,
-    "spent_pkScript": None,
-    "spent_wallet": None,
-    "tick": tick,
-    "original_tick": original_tick,
-    "amount": str(amount),
-    "using_tx_id": str(using_tx_id)
-  }
-  block_events_str += get_event_str(event, "transfer-transfer", inscription_id) + EVENT_SEPARATOR
-  cur.execute('''insert into brc20_events (event_type, block_height, inscription_id, event)
-    values (%s, %s, %s, %s) returning id;''', (event_types["transfer-transfer"], block_height, inscription_id, json.dumps(event)))
-  event_id = cur.fetchone()[0]
-  
-  last_balance = get_last_balance(source_pkScript, tick)
-  last_balance["available_balance"] += amount
-  cur.execute('''insert into brc20_historic_balances (pkscript, wallet, tick, overall_balance, available_balance, block_height, event_id) 
-                values (%s, %s, %s, %s, %s, %s, %s);''', 
-                (source_pkScript, source_wallet, tick, last_balance["overall_balance"], last_balance["available_balance"], block_height, event_id))
-  
-  cur.execute("COMMIT;")
-  in_commit = False
+def mint_inscribe(record):
+  global ticks
+  event_idx = add_block_event(record)
+  add_block_ticker_change(record.tick, record.amount, 0)
 
+  last_balance = get_last_balance(record.minted_pkScript, record.tick)
+  last_balance[OVERALL_BALANCE] += record.amount
+  last_balance[AVAILABLE_BALANCE] += record.amount
+  add_block_balance(record.minted_pkScript, record.minted_wallet, record.tick, last_balance, event_idx)
+  ticks[record.tick][0] -= record.amount
 
-def update_event_hashes(block_height):
-  global block_events_str
-  if len(block_events_str) > 0 and block_events_str[-1] == EVENT_SEPARATOR: block_events_str = block_events_str[:-1] ## remove last separator
-  block_event_hash = get_sha256_hash(block_events_str)
+def transfer_inscribe(record):
+  event_idx = add_block_event(record)
+  block_transfer_inscribes[record.inscription_id] = record
+
+  last_balance = get_last_balance(record.source_pkScript, record.tick)
+  last_balance[AVAILABLE_BALANCE] -= record.amount
+  add_block_balance(record.source_pkScript, record.source_wallet, record.tick, last_balance, event_idx)
+
+def transfer_transfer_normal(record):
+  event_idx = add_block_event(record)
+  block_transfer_transfers[record.inscription_id] = record.using_tx_id
+
+  last_balance = get_last_balance(record.source_pkScript, record.tick)
+  last_balance[OVERALL_BALANCE] -= record.amount
+  add_block_balance(record.source_pkScript, record.source_wallet, record.tick, last_balance, event_idx)
+
+  if record.spent_pkScript != record.source_pkScript:
+    last_balance = get_last_balance(record.spent_pkScript, record.tick)
+  last_balance[OVERALL_BALANCE] += record.amount
+  last_balance[AVAILABLE_BALANCE] += record.amount
+  add_block_balance(record.spent_pkScript, record.spent_wallet, record.tick, last_balance, event_idx, -1) ## negated to make a unique event_id
+
+  if record.spent_pkScript == '6a':
+    add_block_ticker_change(record.tick, 0, record.amount)
+
+def transfer_transfer_spend_to_fee(record):
+  event_idx = add_block_event(record)
+  block_transfer_transfers[record.inscription_id] = record.using_tx_id
+
+  last_balance = get_last_balance(record.source_pkScript, record.tick)
+  last_balance[AVAILABLE_BALANCE] += record.amount
+  add_block_balance(record.source_pkScript, record.source_wallet, record.tick, last_balance, event_idx)
+
+
+def get_block_event_hashes(block_height):
+  ## block event hash of the events hashed so far and the resulting cumulative hash, nothing is written
+  block_event_hash = block_event_hasher.hexdigest()
   cumulative_event_hash = None
-  cur.execute('''select cumulative_event_hash from brc20_cumulative_event_hashes where block_height = %s;''', (block_height - 1,))
-  if cur.rowcount == 0:
+  prev_block = chain_tip.get(block_height - 1)
+  if prev_block is None:
     cumulative_event_hash = block_event_hash
   else:
-    cumulative_event_hash = get_sha256_hash(cur.fetchone()[0] + block_event_hash)
+    cumulative_event_hash = get_sha256_hash(prev_block[CUMULATIVE_EVENT_HASH] + block_event_hash)
+  return block_event_hash, cumulative_event_hash
+
+def update_event_hashes(block_height, block_hash):
+  block_event_hash, cumulative_event_hash = get_block_event_hashes(block_height)
   cur.execute('''INSERT INTO brc20_cumulative_event_hashes (block_height, block_event_hash, cumulative_event_hash) VALUES (%s, %s, %s);''', (block_height, block_event_hash, cumulative_event_hash))
+  chain_tip.append(block_height, block_hash, block_event_hash, cumulative_event_hash)
   return cumulative_event_hash
 
+## hashes of the last indexed blocks, bigger than 10 block reorg is not supported by ord
+chain_tip = ChainTip(10)
+
+def load_chain_tip():
+  cur.execute('''select bh.block_height, bh.block_hash, ceh.block_event_hash, ceh.cumulative_event_hash
+                 from brc20_block_hashes bh
+                 inner join brc20_cumulative_event_hashes ceh on ceh.block_height = bh.block_height
+                 order by bh.block_height desc
+                 limit %s;''', (chain_tip.entries.maxlen,))
+  chain_tip.load(reversed(cur.fetchall()))
+
+## pooled keep-alive sessions for OPI network, event provider and report calls
+http_client = HttpClient()
+## backoff, deadlines and circuit breakers by endpoint for every remote call and for retried main loop steps
+retry_scheduler = RetryScheduler(RetryPolicy(attempts=10, deadline=30, base_delay=0.5, max_delay=8))
+retry_scheduler.set_policy('activity_on_block', RetryPolicy(attempts=3, deadline=120, base_delay=1, max_delay=4))
+retry_scheduler.set_policy('report_block', RetryPolicy(attempts=report_retries, deadline=30, base_delay=0.5, max_delay=4))
+retry_scheduler.set_policy('opi_network', RetryPolicy(base_delay=5, max_delay=60))
+retry_scheduler.set_policy('index_block', RetryPolicy(base_delay=5, max_delay=120))
+retry_scheduler.set_policy('report_queue', RetryPolicy(base_delay=5, max_delay=300))
+retry_scheduler.set_policy('outpoint_index', RetryPolicy(base_delay=5, max_delay=120))
+
+## outpoint -> spending txid of transfer inscriptions, looked up before fetching the block from bitcoind
+outpoint_index = None
+if outpoint_index_enabled:
+  outpoint_index = OutpointIndex(connect_db, rpc_pool, first_inscription_height, retry_scheduler)
+  outpoint_index.start()
+  set_spending_txid_store(outpoint_index)
+
+## wakes the main loop on new blocks, without any source configured it sleeps and polls
+if replay_from_archive_mode:
+  block_notifier = create_block_notifier(http_client) ## replay runs offline, no sources
+else:
+  block_notifier = create_block_notifier(http_client, block_notify_zmq, block_notify_long_poll_url, block_notify_file)
+
 max_block_height_of_opi_network_cache = None
 max_block_height_of_opi_network_cache_ts = 0
 max_block_height_of_opi_network_cache_timeout = 15
@@ -450,480 +491,282 @@ def get_max_block_height_of_opi_network():
   global max_block_height_of_opi_network_cache, max_block_height_of_opi_network_cache_ts, max_block_height_of_opi_network_cache_timeout
   if max_block_height_of_opi_network_cache is not None and time.time() - max_block_height_of_opi_network_cache_ts < max_block_height_of_opi_network_cache_timeout:
     return max_block_height_of_opi_network_cache
-  url = 'https://api.opi.network/lc/get_best_verified_block?event_hash_version=' + str(EVENT_HASH_VERSION)
-  for _ in range(10):
-    try:
-      r = requests.get(url)
-      if r.status_code != 200:
-        print("Error getting best block from OPI network")
-        time.sleep(2)
-        continue
-      max_block_height_of_opi_network_cache = int(r.json()["data"]["best_verified_block"])
-      max_block_height_of_opi_network_cache_ts = time.time()
-      return max_block_height_of_opi_network_cache
-    except:
+  url = opi_api_url + '/lc/get_best_verified_block?event_hash_version=' + str(EVENT_HASH_VERSION)
+  def attempt(remaining):
+    r = http_client.get(url, 'get_best_verified_block', timeout=http_client.deadline_timeout(remaining))
+    if r.status_code != 200:
       print("Error getting best block from OPI network")
-      time.sleep(2)
-      continue
-  return None
+      return None
+    return int(r.json()["data"]["best_verified_block"])
+  best_verified_block = retry_scheduler.run('get_best_verified_block', attempt)
+  if best_verified_block is not None:
+    max_block_height_of_opi_network_cache = best_verified_block
+    max_block_height_of_opi_network_cache_ts = time.time()
+  return best_verified_block
 
 events_providers = []
+def parse_block_events(response, block_height):
+  ## events are streamed from the response and validated one at a time, only the compact parsed events are kept
+  parsed_events, rejection = validate_block(iter_json_array(response.iter_content(chunk_size=65536), "result"), block_height, SELF_MINT_ENABLE_HEIGHT)
+  if rejection is not None: raise ValueError("invalid event " + rejection)
+  return parsed_events
+
+provider_registry = ProviderRegistry(http_client, EVENT_PROVIDER_USABLE_EVENT_HASH_VERSIONS, max_inflight=provider_max_inflight, parse_events=parse_block_events, retry_scheduler=retry_scheduler)
 def get_events_providers():
   global events_providers
   events_providers = []
-  url = 'https://api.opi.network/lc/get_verified_event_providers?event_hash_version=' + str(EVENT_HASH_VERSION)
-  for _ in range(10):
-    try:
-      r = requests.get(url)
-      if r.status_code != 200:
-        print("Error getting event providers from OPI network")
-        time.sleep(2)
-        continue
-      events_providers_temp = r.json()["data"]
-      for ep in events_providers_temp:
-        events_providers.append(ep["url"])
-      if len(events_providers) == 0:
-        print("No event providers found on OPI network")
-        time.sleep(2)
-        continue
-      return True
-    except:
+  url = opi_api_url + '/lc/get_verified_event_providers?event_hash_version=' + str(EVENT_HASH_VERSION)
+  def attempt(remaining):
+    r = http_client.get(url, 'get_verified_event_providers', timeout=http_client.deadline_timeout(remaining))
+    if r.status_code != 200:
       print("Error getting event providers from OPI network")
-      time.sleep(2)
-      continue
-  return False
+      return None
+    urls = [ep["url"] for ep in r.json()["data"]]
+    if len(urls) == 0:
+      print("No event providers found on OPI network")
+      return None
+    return urls
+  urls = retry_scheduler.run('get_verified_event_providers', attempt)
+  if urls is None: return False
+  events_providers = urls
+  provider_registry.set_urls(events_providers)
+  return True
 
-get_block_info_from_opi_network_cache = None
-get_block_info_from_opi_network_cache_ts = 0
+## block_height -> (ts, [block_hash, cumulative_hash]), shared by the main loop and prefetch workers
+get_block_info_from_opi_network_cache = {}
 get_block_info_from_opi_network_cache_timeout = 15
-get_block_info_from_opi_network_cache_block_height = None
+get_block_info_from_opi_network_cache_max_size = 64
 def get_block_info_from_opi_network(block_height):
-  global get_block_info_from_opi_network_cache, get_block_info_from_opi_network_cache_ts, get_block_info_from_opi_network_cache_timeout, get_block_info_from_opi_network_cache_block_height
-  if get_block_info_from_opi_network_cache_block_height == block_height and get_block_info_from_opi_network_cache is not None and time.time() - get_block_info_from_opi_network_cache_ts < get_block_info_from_opi_network_cache_timeout:
-    return get_block_info_from_opi_network_cache
+  global get_block_info_from_opi_network_cache, get_block_info_from_opi_network_cache_timeout
+  cached = get_block_info_from_opi_network_cache.get(block_height)
+  if cached is not None and time.time() - cached[0] < get_block_info_from_opi_network_cache_timeout:
+    return cached[1]
   block_hash = None
   opi_cumulative_event_hash = None
-  url = 'https://api.opi.network/lc/get_best_hashes_for_block/' + str(block_height) + '?event_hash_version=' + str(EVENT_HASH_VERSION)
-  for _ in range(10):
-    try:
-      r = requests.get(url)
-      if r.status_code != 200:
-        print("Error getting best hash info from OPI network")
-        time.sleep(2)
-        continue
-      js = r.json()
-      block_hash = js["data"]["best_block_hash"]
-      opi_cumulative_event_hash = js["data"]["best_cumulative_hash"]
-      get_block_info_from_opi_network_cache = [block_hash, opi_cumulative_event_hash]
-      get_block_info_from_opi_network_cache_ts = time.time()
-      get_block_info_from_opi_network_cache_block_height = block_height
-      return get_block_info_from_opi_network_cache
-    except:
+  url = opi_api_url + '/lc/get_best_hashes_for_block/' + str(block_height) + '?event_hash_version=' + str(EVENT_HASH_VERSION)
+  def attempt(remaining):
+    r = http_client.get(url, 'get_best_hashes_for_block', timeout=http_client.deadline_timeout(remaining))
+    if r.status_code != 200:
       print("Error getting best hash info from OPI network")
-      time.sleep(2)
-      continue
-  return [None, None]
+      return None
+    js = r.json()
+    return [js["data"]["best_block_hash"], js["data"]["best_cumulative_hash"]]
+  block_info = retry_scheduler.run('get_best_hashes_for_block', attempt)
+  if block_info is None: return [None, None]
+  get_block_info_from_opi_network_cache[block_height] = (time.time(), block_info)
+  if len(get_block_info_from_opi_network_cache) > get_block_info_from_opi_network_cache_max_size:
+    for h, cached in list(get_block_info_from_opi_network_cache.items()):
+      if time.time() - cached[0] >= get_block_info_from_opi_network_cache_timeout:
+        get_block_info_from_opi_network_cache.pop(h, None)
+  return block_info
 
 def get_block_from_opi_network(block_height):
-  global events_providers
+  ## returns the validated events of the block as (event_type, tick, original_tick, values) tuples, see event_validation
   events = None
   block_hash, opi_cumulative_event_hash = get_block_info_from_opi_network(block_height)
   if block_hash is None or opi_cumulative_event_hash is None: return [None, None, None]
   if block_height < first_inscription_height: return [[], block_hash, opi_cumulative_event_hash]
-  inner_event_providers = events_providers.copy()
-  while len(inner_event_providers) != 0:
-    event_provider = random.choice(inner_event_providers)
-    print("Trying to get events from " + event_provider)
-    url = event_provider + '/v1/brc20/event_hash_version'
-    try:
-      r = requests.get(url)
-      if r.status_code != 200:
-        print("Error getting event hash version from Event Provider")
-        inner_event_providers.remove(event_provider)
-        time.sleep(0.1)
-        continue
-      if int(r.text) not in EVENT_PROVIDER_USABLE_EVENT_HASH_VERSIONS:
-        print("Event provider is using a different Event Hash Version!!")
-        print("Event Provider event hash version: " + r.text)
-        print("Usable event hash version: " + str(EVENT_PROVIDER_USABLE_EVENT_HASH_VERSIONS))
-        inner_event_providers.remove(event_provider)
-        time.sleep(0.1)
-        continue
-    except:
-      print("Error getting db version from Event Provider")
-      inner_event_providers.remove(event_provider)
-      time.sleep(0.1)
-      continue
-    url = event_provider + '/v1/brc20/block_height'
-    try:
-      r = requests.get(url)
-      if r.status_code != 200:
-        print("Error getting block height from Event Provider")
-        inner_event_providers.remove(event_provider)
-        time.sleep(0.1)
-        continue
-      if int(r.text) < block_height:
-        print("Block not indexed yet by event provider!!")
-        print("Event Provider block height: " + r.text)
-        print("Requested block height: " + str(block_height))
-        inner_event_providers.remove(event_provider)
-        time.sleep(0.1)
-        continue
-    except:
-      print("Error getting block height from Event Provider")
-      inner_event_providers.remove(event_provider)
-      time.sleep(0.1)
-      continue
-    url = event_provider + '/v1/brc20/activity_on_block?block_height=' + str(block_height)
-    for _ in range(10):
-      try:
-        r = requests.get(url)
-        if r.status_code != 200:
-          print("Error getting events from Event Provider")
-          time.sleep(1)
-          continue
-        events = r.json()["result"]
-        return [events, block_hash, opi_cumulative_event_hash]
-      except:
-        print("Error getting events from Event Provider")
-        time.sleep(1)
-        continue
-  return [None, None, None]
+  ## fastest healthy provider first, hedged to the next one when it is slow, providers have their own circuit breakers
+  events = retry_scheduler.run('activity_on_block', lambda remaining: provider_registry.get_events(block_height, remaining), breaker=False)
+  if events is None:
+    print("Error getting events from Event Providers")
+    return [None, None, None]
+  return [events, block_hash, opi_cumulative_event_hash]
+
+def archive_event(event, using_tx_ids):
+  ## the resolved spending txid is kept with transfer-transfer events so a replay does not need bitcoind
+  event_dict = event_to_dict(*event)
+  if event[0] == 'transfer-transfer' and event[3][0] in using_tx_ids:
+    event_dict["using_tx_id"] = using_tx_ids[event[3][0]]
+  return event_dict
+
+archived_using_tx_ids = {} ## inscription id -> using_tx_id of transfer-transfer events of the block read from the archive
+def get_block_from_archive(block_height):
+  global archived_using_tx_ids
+  record = event_archive.read(block_height)
+  if record is None:
+    print("Block " + str(block_height) + " not found in archive")
+    return [None, None, None]
+  parsed_events, rejection = validate_block(record["events"], block_height, SELF_MINT_ENABLE_HEIGHT)
+  if rejection is not None:
+    print("Invalid event in archive: " + rejection)
+    return [None, None, None]
+  archived_using_tx_ids = {event["inscription_id"]: event["using_tx_id"] for event in record["events"]
+                           if event.get("event_type") == 'transfer-transfer' and "using_tx_id" in event}
+  return [parsed_events, record["block_hash"], record["cumulative_event_hash"]]
+
+## downloads upcoming blocks in the background, results are consumed in order by index_block
+block_prefetcher = BlockPrefetcher(get_block_from_opi_network, prefetch_blocks, prefetch_workers, get_block_info_from_opi_network_cache_timeout)
 
 def index_block(block_height):
-  global ticks, block_events_str
+  global ticks
   print("Indexing block " + str(block_height))
   
-  # Log Bitcoin RPC availability
-  if is_bitcoin_rpc_available():
+  # Log Bitcoin RPC availability, cached and refreshed in the background
+  if replay_from_archive_mode:
+    pass ## spending txids come from the archive, bitcoind is not probed
+  elif is_bitcoin_rpc_available():
     print("✅ Bitcoin RPC available - will lookup real spending txids")
   else:
     print("⚠️  Bitcoin RPC not available - using fallback txid (-1)")
   
-  block_events_str = ""
+  clear_block_changes()
   error = False
   
-  events, block_hash, opi_cumulative_event_hash = get_block_from_opi_network(block_height)
-  if events is None:
+  ## events are validated while they are downloaded
+  prefetched = get_block_from_archive(block_height) if replay_from_archive_mode else block_prefetcher.take(block_height)
+  if prefetched is not None:
+    parsed_events, block_hash, opi_cumulative_event_hash = prefetched
+  else:
+    parsed_events, block_hash, opi_cumulative_event_hash = get_block_from_opi_network(block_height)
+  if parsed_events is None:
     print("An error happened while fetching the events.")
     return False
   
-  if len(events) == 0:
+  if len(parsed_events) == 0:
     print("No events found for block " + str(block_height))
-    our_cumulative_event_hash = update_event_hashes(block_height)
-    if our_cumulative_event_hash != opi_cumulative_event_hash:
-      print("Cumulative event hash mismatch!!")
-      print("OPI cumulative event hash: " + opi_cumulative_event_hash)
-      print("Our cumulative event hash: " + our_cumulative_event_hash)
-      return False
-    cur.execute('''INSERT INTO brc20_block_hashes (block_height, block_hash) VALUES (%s, %s);''', (block_height, block_hash))
-    return True
-  print("Event count: ", len(events))
+  else:
+    print("Event count: ", len(parsed_events))
 
-  ## refresh ticks
   sttm = time.time()
-  cur.execute('''select tick, remaining_supply, limit_per_mint, decimals, is_self_mint, deploy_inscription_id from brc20_tickers;''')
-  ticks_ = cur.fetchall()
-  ticks = {}
-  for t in ticks_:
-    ticks[t[0]] = [t[1], t[2], t[3], t[4], t[5]]
-  print("Ticks refreshed in " + str(time.time() - sttm) + " seconds")
+  preload_balances(parsed_events)
+  print("Balances preloaded in " + str(time.time() - sttm) + " seconds")
   
+  sttm = time.time()
   idx = 0
-  for event in events:
+  for event_type, tick, original_tick, values in parsed_events:
     idx += 1
     if idx % 100 == 0:
-      print(idx, '/', len(events))
-    
-    if "tick" not in event: 
-      error = True
-      break ## invalid event
-
-    tick = event["tick"]
-    original_tick = event["original_tick"]
-    try: 
-      if tick != original_tick.lower():
-        error = True 
-        break ## invalid tick
-    except:
-      error = True 
-      break ## invalid tick
-    original_tick_len = utf8len(original_tick)
-    if original_tick_len != 4 and original_tick_len != 5: 
-      error = True
-      break ## invalid tick
+      print(idx, '/', len(parsed_events))
     
     # handle deploy
-    if event["event_type"] == 'deploy-inscribe':
+    if event_type == 'deploy-inscribe':
+      inscription_id, deployer_pkScript, max_supply, decimals, limit_per_mint, is_self_mint = values
       if tick in ticks: 
-        error = True
-        break ## already deployed
-
-      if "max_supply" not in event: 
-        error = True
-        break ## invalid event
-      if "inscription_id" not in event:
-        error = True
-        break ## invalid event
-      if "deployer_pkScript" not in event:
-        error = True
-        break ## invalid event
-      #if "deployer_wallet" not in event:
-      #  error = True
-      #  break ## invalid event
-      if "decimals" not in event:
-        error = True
-        break ## invalid event
-      if "limit_per_mint" not in event:
-        error = True
-        break ## invalid event
-      if "is_self_mint" not in event:
-        error = True
-        break ## invalid event
-
-      if not is_positive_number(event["decimals"]): 
-        error = True
-        break ## invalid decimals
-      if not is_positive_number(event["max_supply"]): 
-        error = True
+        error = "already deployed"
         break
-      if not is_positive_number(event["limit_per_mint"]): 
-        error = True
-        break ## invalid limit per mint
-      
-      decimals = int(event["decimals"])
-      if decimals > 18: 
-        error = True
-        break ## invalid decimals
-
-      max_supply = int(event["max_supply"])
-      if max_supply is None: 
-        error = True
-        break ## invalid max supply
-      if max_supply > (2**64-1) * (10**18) or max_supply < 0: 
-        error = True
-        break ## invalid max supply
-
-      limit_per_mint = int(event["limit_per_mint"])
-      if limit_per_mint is None: 
-        error = True
-        break ## invalid limit per mint
-      if limit_per_mint > (2**64-1) * (10**18) or limit_per_mint <= 0: 
-        error = True
-        break ## invalid limit per mint
-      
-      is_self_mint = event["is_self_mint"]
-      if is_self_mint != "true" and is_self_mint != "false": 
-        error = True
-        break
-      if is_self_mint == 'true':
-        if original_tick_len != 5: 
-          error = True
-          break
-        if block_height < SELF_MINT_ENABLE_HEIGHT:
-          error = True
-          break ## self-mint not enabled yet
-        if max_supply == 0: 
-          max_supply = (2**64-1) * (10**18) ## infinite(ish) mint
-          if limit_per_mint == 0:
-            limit_per_mint = (2**64-1) * (10**18)
-      else:
-        if original_tick_len != 4: 
-          error = True
-          break
-      if max_supply == 0: continue ## invalid max supply
-      
-      inscr_id = event["inscription_id"]
-      deployer_pkScript = event["deployer_pkScript"]
-      deployer_wallet = script_to_address(event["deployer_pkScript"])
-      deploy_inscribe(block_height, inscr_id, deployer_pkScript, deployer_wallet, tick, original_tick, max_supply, decimals, limit_per_mint, is_self_mint)
+      deploy_inscribe(DeployInscribeEvent(inscription_id, deployer_pkScript, script_to_address(deployer_pkScript), tick, original_tick, max_supply, decimals, limit_per_mint, is_self_mint))
     
     # handle mint
-    if event["event_type"] == 'mint-inscribe':
+    elif event_type == 'mint-inscribe':
+      inscription_id, minted_pkScript, amount, parent_id = values
       if tick not in ticks: 
-        error = True
-        break ## not deployed
-
-      if "amount" not in event: 
-        error = True
-        break ## invalid event
-      if "inscription_id" not in event:
-        error = True
-        break ## invalid event
-      if "minted_pkScript" not in event:
-        error = True
-        break ## invalid event
-      #if "minted_wallet" not in event:
-      #  error = True
-      #  break ## invalid event
-      if "parent_id" not in event:
-        error = True
-        break ## invalid event
-
-      if not is_positive_number(event["amount"]): 
-        error = True
-        break ## invalid amount
-
-      amount = int(event["amount"])
-      if amount is None: 
-        error = True
-        break ## invalid amount
-      if amount > (2**64-1) * (10**18) or amount <= 0: 
-        error = True
-        break ## invalid amount
-
+        error = "not deployed"
+        break
       if ticks[tick][0] <= 0: 
-        error = True
-        break ## mint ended
-
+        error = "mint ended"
+        break
       if ticks[tick][1] is not None and amount > ticks[tick][1]: 
-        error = True
-        break ## mint too much
-
-      if amount > ticks[tick][0]: ## mint too much
-        error = True
-        break ## mint too much
-
-      parent_id = event["parent_id"]
-      if ticks[tick][3]: ## self-mint
-        ## check parent token
-        if ticks[tick][4] != parent_id:
-          error = True
-          break ## invalid parent token
-
-      inscr_id = event["inscription_id"]
-      minted_pkScript = event["minted_pkScript"]
-      minted_wallet = script_to_address(event["minted_pkScript"])
-      mint_inscribe(block_height, inscr_id, minted_pkScript, minted_wallet, tick, original_tick, amount, parent_id)
+        error = "mint more than limit per mint"
+        break
+      if amount > ticks[tick][0]:
+        error = "mint more than remaining supply"
+        break
+      if ticks[tick][3] and ticks[tick][4] != parent_id: ## self-mint
+        error = "invalid parent token"
+        break
+      mint_inscribe(MintInscribeEvent(inscription_id, minted_pkScript, script_to_address(minted_pkScript), tick, original_tick, amount, parent_id))
     
     # handle transfer
-    if event["event_type"] == 'transfer-inscribe':
+    elif event_type == 'transfer-inscribe':
+      inscription_id, source_pkScript, amount = values
       if tick not in ticks: 
-        error = True
-        break ## not deployed
-
-      if "amount" not in event: 
-        error = True
-        break ## invalid event
-      if "inscription_id" not in event:
-        error = True
-        break ## invalid event
-      if "source_pkScript" not in event:
-        error = True
-        break ## invalid event
-      #if "source_wallet" not in event:
-      #  error = True
-      #  break ## invalid event
-
-      if not is_positive_number(event["amount"]): 
-        error = True
-        break ## invalid amount
-
-      amount = int(event["amount"])
-      if amount is None: 
-        error = True
-        break ## invalid amount
-      if amount > (2**64-1) * (10**18) or amount <= 0: 
-        error = True
-        break ## invalid amount
-      
-      inscr_id = event["inscription_id"]
-      source_pkScript = event["source_pkScript"]
-      source_wallet = script_to_address(event["source_pkScript"])
+        error = "not deployed"
+        break
       ## check if available balance is enough
       if not check_available_balance(source_pkScript, tick, amount): 
-        error = True
-        break ## not enough available balance
-      transfer_inscribe(block_height, inscr_id, source_pkScript, source_wallet, tick, original_tick, amount)
+        error = "not enough available balance"
+        break
+      transfer_inscribe(TransferInscribeEvent(inscription_id, source_pkScript, script_to_address(source_pkScript), tick, original_tick, amount))
 
     # handle transfer
-    if event["event_type"] == 'transfer-transfer':
+    elif event_type == 'transfer-transfer':
+      inscr_id, source_pkScript, spent_pkScript, amount = values
       if tick not in ticks: 
-        error = True
-        break ## not deployed
-
-      if "amount" not in event: 
-        error = True
-        break ## invalid event
-      if "inscription_id" not in event:
-        error = True
-        break ## invalid event
-      if "source_pkScript" not in event:
-        error = True
-        break ## invalid event
-      #if "source_wallet" not in event:
-      #  error = True
-      #  break ## invalid event
-      if "spent_pkScript" not in event:
-        error = True
-        break ## invalid event
-      #if "spent_wallet" not in event:
-      #  error = True
-      #  break ## invalid event
-
-      if not is_positive_number(event["amount"]): 
-        error = True
-        break ## invalid amount
-
-      amount = int(event["amount"])
-      if amount is None: 
-        error = True
-        break ## invalid amount
-      if amount > (2**64-1) * (10**18) or amount <= 0: 
-        error = True
-        break ## invalid amount
-
-      inscr_id = event["inscription_id"]
-      source_pkScript = event["source_pkScript"]
-      source_wallet = script_to_address(event["source_pkScript"])
-      spent_pkScript = event["spent_pkScript"]
-      spent_wallet = script_to_address(event["spent_pkScript"])
-      ## check if available balance is enough
+        error = "not deployed"
+        break
       if is_used_or_invalid(inscr_id): 
-        error = True
-        break ## already used or invalid
+        error = "transfer inscription already used or invalid"
+        break
       
-      # Get spending txid using Bitcoin RPC with fallback to -1
-      spending_txid = get_spending_txid_with_fallback(block_height, inscr_id)
+      # Get spending txid using Bitcoin RPC with fallback to -1, replayed blocks use the archived one
+      if replay_from_archive_mode and inscr_id in archived_using_tx_ids:
+        spending_txid = archived_using_tx_ids[inscr_id]
+      else:
+        spending_txid = get_spending_txid_with_fallback(block_height, inscr_id, block_hash)
       
+      ## source is taken from the transfer-inscribe event
+      inscribe_record = get_transfer_inscribe_event(inscr_id)
+      record = TransferTransferEvent(inscr_id, inscribe_record.source_pkScript, inscribe_record.source_wallet, spent_pkScript, script_to_address(spent_pkScript), tick, original_tick, amount, spending_txid)
       if spent_pkScript is None: 
-        transfer_transfer_spend_to_fee(block_height, inscr_id, tick, original_tick, amount, spending_txid)
+        transfer_transfer_spend_to_fee(record)
       else: 
-        transfer_transfer_normal(block_height, inscr_id, spent_pkScript, spent_wallet, tick, original_tick, amount, spending_txid)
+        transfer_transfer_normal(record)
   
   if error:
+    print("Invalid event (" + event_type + " " + values[0] + "): " + error)
+    discard_block_changes()
     return False
+  print("Events applied in " + str(time.time() - sttm) + " seconds")
   
-  our_cumulative_event_hash = update_event_hashes(block_height)
+  ## verify against OPI before anything is written, a mismatching block is rejected with zero DB writes
+  block_event_hash, our_cumulative_event_hash = get_block_event_hashes(block_height)
   if our_cumulative_event_hash != opi_cumulative_event_hash:
     print("Cumulative event hash mismatch!!")
     print("OPI cumulative event hash: " + opi_cumulative_event_hash)
     print("Our cumulative event hash: " + our_cumulative_event_hash)
+    discard_block_changes()
     return False
-  # end of block
-  cur.execute('''INSERT INTO brc20_block_hashes (block_height, block_hash) VALUES (%s, %s);''', (block_height, block_hash))
-  conn.commit()
+  
+  sttm = time.time()
+  using_tx_ids = block_transfer_transfers ## cleared by flush_block_changes
+  flush_block_changes(block_height, block_hash, block_event_hash, our_cumulative_event_hash)
+  print("Block queued for writing in " + str(time.time() - sttm) + " seconds, " + str(block_writer.pending()) + " blocks pending")
+  if event_archive is not None and not replay_from_archive_mode:
+    try:
+      event_archive.append(block_height, block_hash, our_cumulative_event_hash, [archive_event(e, using_tx_ids) for e in parsed_events])
+    except:
+      traceback.print_exc()
+      print("Error appending block to event archive")
+  trim_balance_cache()
+  if stats_interval > 0 and block_height % stats_interval == 0:
+    print_stats()
   print("ALL DONE")
   return True
 
+def print_stats():
+  print("Balance cache: " + balance_cache.stats())
+  print("HTTP: " + http_client.stats())
+  print("Prefetch: " + block_prefetcher.stats())
+  print("Providers: " + provider_registry.stats())
+  print("Block notifications: " + block_notifier.stats())
+  print("Circuits: " + retry_scheduler.stats())
+  if not replay_from_archive_mode and is_bitcoin_rpc_available(): print("Bitcoin RPC: " + bitcoin_rpc_stats())
+  if outpoint_index is not None: print("Outpoint index: " + outpoint_index.stats())
+  if hash_reporter is not None: print("Reports: " + hash_reporter.stats())
 
 
+
+## returns the reorg height, None if there is no reorg and False if the OPI network did not answer
 def check_for_reorg():
-  cur.execute('select block_height, block_hash from brc20_block_hashes order by block_height desc limit 1;')
-  if cur.rowcount == 0: return None ## nothing indexed yet
-  last_block = cur.fetchone()
+  last_block = chain_tip.last()
+  if last_block is None: return None ## nothing indexed yet
 
-  opi_block_hash, opi_cumulative_event_hash = get_block_info_from_opi_network(last_block[0])
-  if opi_block_hash == last_block[1]: return None ## last block hashes are the same, no reorg
+  opi_block_hash, opi_cumulative_event_hash = get_block_info_from_opi_network(last_block[BLOCK_HEIGHT])
+  if opi_block_hash is None: return False ## unknown, not a mismatch
+  if opi_block_hash == last_block[BLOCK_HASH]: return None ## last block hashes are the same, no reorg
 
   print("REORG DETECTED!!")
-  cur.execute('select block_height, block_hash from brc20_block_hashes order by block_height desc limit 10;')
-  hashes = cur.fetchall() ## get last 10 hashes
+  get_block_info_from_opi_network_cache.clear() ## cached hashes of earlier blocks may be from the old chain
+  hashes = chain_tip.latest() ## last 10 hashes
   for h in hashes:
-    opi_block_hash, opi_cumulative_event_hash = get_block_info_from_opi_network(h[0])
-    if opi_block_hash == h[1]: ## found reorg height by a matching hash
-      print("REORG HEIGHT FOUND: " + str(h[0]))
-      return h[0]
+    opi_block_hash, opi_cumulative_event_hash = get_block_info_from_opi_network(h[BLOCK_HEIGHT])
+    if opi_block_hash is None: ## unknown, the walk back starts over on the next check
+      print("Could not get block hash of " + str(h[BLOCK_HEIGHT]) + " from OPI network")
+      return False
+    if opi_block_hash == h[BLOCK_HASH]: ## found reorg height by a matching hash
+      print("REORG HEIGHT FOUND: " + str(h[BLOCK_HEIGHT]))
+      return h[BLOCK_HEIGHT]
   
   ## bigger than 10 block reorg is not supported by ord
   print("CRITICAL ERROR!!")
@@ -931,8 +774,14 @@ def check_for_reorg():
 
 def reorg_fix(reorg_height):
   global event_types
+  spending_txid_index.invalidate(reorg_height + 1)
   cur.execute('begin;')
-  cur.execute('delete from brc20_tickers where block_height > %s;', (reorg_height,)) ## delete new tickers
+  ## fetch transfer events for reverting unused_transfer_inscribes
+  cur.execute('''select event_type, inscription_id, event from brc20_events where block_height > %s and (event_type = %s or event_type = %s);''', 
+              (reorg_height, event_types["transfer-inscribe"], event_types["transfer-transfer"]))
+  transfer_rows = cur.fetchall()
+  cur.execute('delete from brc20_tickers where block_height > %s returning tick;', (reorg_height,)) ## delete new tickers
+  deleted_ticks = cur.fetchall()
   ## fetch mint events for reverting remaining_supply in other tickers
   cur.execute('''select event from brc20_events where event_type = %s and block_height > %s;''', (event_types["mint-inscribe"], reorg_height,))
   rows = cur.fetchall()
@@ -957,6 +806,20 @@ def reorg_fix(reorg_height):
   cur.execute("SELECT setval('brc20_block_hashes_id_seq', max(id)) from brc20_block_hashes;") ## reset id sequence
   cur.execute('commit;')
   reset_caches()
+  load_chain_tip()
+  for row in deleted_ticks:
+    ticks.pop(row[0], None)
+  for tick in tick_changes:
+    if tick in ticks:
+      ticks[tick][0] += tick_changes[tick]
+  ## first restore inscriptions transferred after reorg_height, then drop the ones inscribed after it
+  for row in transfer_rows:
+    if row[0] == event_types["transfer-transfer"]:
+      event = row[2]
+      unused_transfer_inscribes[row[1]] = TransferInscribeEvent(row[1], event["source_pkScript"], event["source_wallet"], event["tick"], event["original_tick"], int(event["amount"]))
+  for row in transfer_rows:
+    if row[0] == event_types["transfer-inscribe"]:
+      unused_transfer_inscribes.pop(row[1], None)
 
 def check_if_there_is_residue_from_last_run():
   cur.execute('''select max(block_height) from brc20_block_hashes;''')
@@ -1017,38 +880,42 @@ event_types_rev = {}
 for key in event_types:
   event_types_rev[event_types[key]] = key
 
-if not get_events_providers():
+load_unused_transfer_inscribes()
+load_ticks()
+load_chain_tip()
+
+def reload_state_from_db():
+  ## in-memory state is rebuilt from the db after a failed block write dropped verified blocks
+  reset_caches()
+  load_unused_transfer_inscribes()
+  load_ticks()
+  load_chain_tip()
+
+if not replay_from_archive_mode and not get_events_providers():
   print("Error getting event providers from OPI network")
   exit(1)
 
 def reindex_cumulative_hashes():
   global event_types_rev, ticks
   cur.execute('''delete from brc20_cumulative_event_hashes;''')
-  cur.execute('''select min(block_height), max(block_height) from brc20_block_hashes;''')
-  row = cur.fetchone()
-  min_block = row[0]
-  max_block = row[1]
+  cur.execute('''select block_height, block_hash from brc20_block_hashes;''')
+  block_hashes = dict(cur.fetchall())
+  min_block = min(block_hashes)
+  max_block = max(block_hashes)
 
-  sttm = time.time()
-  cur.execute('''select tick, remaining_supply, limit_per_mint, decimals, is_self_mint, deploy_inscription_id from brc20_tickers;''')
-  ticks_ = cur.fetchall()
-  ticks = {}
-  for t in ticks_:
-    ticks[t[0]] = [t[1], t[2], t[3], t[4], t[5]]
-  print("Ticks refreshed in " + str(time.time() - sttm) + " seconds")
+  load_ticks()
+  chain_tip.clear()
 
   print("Reindexing cumulative hashes from " + str(min_block) + " to " + str(max_block))
   for block_height in range(min_block, max_block + 1):
     print("Reindexing block " + str(block_height))
-    block_events_str = ""
+    reset_block_event_hash()
     cur.execute('''select event, event_type, inscription_id from brc20_events where block_height = %s order by id asc;''', (block_height,))
     rows = cur.fetchall()
-    for row in rows:
-      event = row[0]
-      event_type = event_types_rev[row[1]]
-      inscription_id = row[2]
-      block_events_str += get_event_str(event, event_type, inscription_id) + EVENT_SEPARATOR
-    update_event_hashes(block_height)
+    for idx, row in enumerate(rows):
+      record = EVENT_RECORD_TYPES[event_types_rev[row[1]]].from_db(row[2], row[0])
+      update_block_event_hash(get_event_str(record), idx == 0)
+    update_event_hashes(block_height, block_hashes[block_height])
 
 def fix_db_from_version(version):
   if version == 4:
@@ -1081,30 +948,32 @@ else:
 
 def try_to_report_with_retries(to_send):
   global report_url, report_retries
-  for _ in range(0, report_retries):
-    try:
-      r = requests.post(report_url, json=to_send)
-      if r.status_code == 200:
-        print("Reported hashes to metaprotocol indexer indexer.")
-        return
-      else:
-        print("Error while reporting hashes to metaprotocol indexer indexer, status code: " + str(r.status_code))
-    except:
-      print("Error while reporting hashes to metaprotocol indexer indexer, retrying...")
-    time.sleep(1)
-  print("Error while reporting hashes to metaprotocol indexer indexer, giving up.")
+  def attempt(remaining):
+    r = http_client.post(report_url, 'report_block', json=to_send, timeout=http_client.deadline_timeout(remaining))
+    if r.status_code != 200:
+      print("Error while reporting hashes to metaprotocol indexer indexer, status code: " + str(r.status_code))
+      return None
+    return True
+  if retry_scheduler.run('report_block', attempt):
+    print("Reported hashes to metaprotocol indexer indexer for block " + str(to_send["block_height"]) + ".")
+    return True
+  print("Error while reporting hashes to metaprotocol indexer indexer, retrying in background.")
+  return False
+
+## reports are sent in the background so indexing never waits for the report endpoint, replay runs offline and does not report
+hash_reporter = None
+if report_to_indexer and not replay_from_archive_mode:
+  hash_reporter = HashReporter(try_to_report_with_retries, retry_scheduler, state_path=report_state_file or None)
 
 def report_hashes(block_height):
   global report_to_indexer
   if not report_to_indexer:
     print("Reporting to metaprotocol indexer is disabled.")
     return
-  cur.execute('''select block_event_hash, cumulative_event_hash from brc20_cumulative_event_hashes where block_height = %s;''', (block_height,))
-  row = cur.fetchone()
-  block_event_hash = row[0]
-  cumulative_event_hash = row[1]
-  cur.execute('''select block_hash from brc20_block_hashes where block_height = %s;''', (block_height,))
-  block_hash = cur.fetchone()[0]
+  block = chain_tip.get(block_height)
+  block_hash = block[BLOCK_HASH]
+  block_event_hash = block[BLOCK_EVENT_HASH]
+  cumulative_event_hash = block[CUMULATIVE_EVENT_HASH]
   to_send = {
     "name": report_name,
     "type": "brc20",
@@ -1117,8 +986,8 @@ def report_hashes(block_height):
     "block_event_hash": block_event_hash,
     "cumulative_event_hash": cumulative_event_hash
   }
-  print("Sending hashes to metaprotocol indexer indexer...")
-  try_to_report_with_retries(to_send)
+  print("Queueing hashes for metaprotocol indexer indexer...")
+  hash_reporter.submit(to_send)
 
 def reorg_on_extra_tables(reorg_height):
   cur.execute('begin;')
@@ -1364,50 +1233,101 @@ if create_extra_tables:
   print("checking extra tables")
   check_extra_tables()
 
+def replay_from_archive():
+  last_archived_block = event_archive.last_height()
+  if last_archived_block is None:
+    print("Event archive is empty")
+    exit(1)
+  last_block = chain_tip.last()
+  if last_block is not None:
+    record = event_archive.read(last_block[BLOCK_HEIGHT])
+    if record is None or record["block_hash"] != last_block[BLOCK_HASH]:
+      print("Last indexed block " + str(last_block[BLOCK_HEIGHT]) + " is not in the event archive, cannot replay")
+      exit(1)
+  print("Replaying blocks up to " + str(last_archived_block) + " from event archive")
+  while True:
+    last_block = chain_tip.last()
+    current_block = first_inscription_height if last_block is None else last_block[BLOCK_HEIGHT] + 1
+    if current_block > last_archived_block:
+      if not sync_block_writer():
+        print("Block replay failed.")
+        exit(1)
+      if create_extra_tables:
+        check_extra_tables()
+      print("Replay finished at block " + str(current_block - 1))
+      return
+    if not index_block(current_block):
+      print("Block %s replay failed." % current_block)
+      exit(1)
+    print("Block %s replayed." % current_block)
+    if create_extra_tables:
+      sync_block_writer() ## extra tables are built from the written tables with separate queries
+      check_extra_tables()
+
+if replay_from_archive_mode:
+  replay_from_archive()
+  exit(0)
+
 last_report_height = 0
 while True:
-  check_if_there_is_residue_from_last_run()
+  if block_writer.pending() == 0: ## tables are compared with separate queries, not safe while a block is being written
+    check_if_there_is_residue_from_last_run()
   if create_extra_tables:
     check_if_there_is_residue_on_extra_tables_from_last_run()
-  cur.execute('''select max(block_height) from brc20_block_hashes;''')
-  row = cur.fetchone()
+  ## the chain tip includes verified blocks that are still queued for writing
+  last_block = chain_tip.last()
   current_block = None
-  if row[0] is None: current_block = first_inscription_height
-  else: current_block = row[0] + 1
+  if last_block is None: current_block = first_inscription_height
+  else: current_block = last_block[BLOCK_HEIGHT] + 1
   max_block_height_of_opi_network = get_max_block_height_of_opi_network()
   if max_block_height_of_opi_network is None:
     print("Waiting for OPI network...")
-    time.sleep(5)
+    time.sleep(retry_scheduler.failure('opi_network'))
     continue
+  retry_scheduler.success('opi_network')
 
   if current_block > max_block_height_of_opi_network:
+    sync_block_writer()
+    if create_extra_tables: ## extra tables only see blocks once they are written
+      check_extra_tables()
     print("Waiting for new blocks...")
-    time.sleep(5)
+    if block_notifier.wait(5):
+      max_block_height_of_opi_network_cache = None ## notified, ask the OPI network right away
     continue
   
   print("Processing block %s" % current_block)
   reorg_height = check_for_reorg()
+  if reorg_height is False:
+    print("Waiting for OPI network...")
+    time.sleep(retry_scheduler.failure('check_for_reorg'))
+    continue
+  retry_scheduler.success('check_for_reorg')
   if reorg_height is not None:
+    block_prefetcher.invalidate()
+    sync_block_writer()
     print("Rolling back to ", reorg_height)
     reorg_fix(reorg_height)
     print("Rolled back to " + str(reorg_height))
     continue
+  block_prefetcher.schedule(current_block, max_block_height_of_opi_network)
   try:
     if index_block(current_block):
       print("Block %s indexed." % current_block)
+      retry_scheduler.success('index_block')
+      block_notifier.settle()
+      if ticks_check_interval > 0 and current_block % ticks_check_interval == 0:
+        verify_ticks()
       if create_extra_tables:
         print("checking extra tables")
+        sync_block_writer() ## extra tables are built from the written tables with separate queries
         check_extra_tables()
       if max_block_height_of_opi_network - current_block < 10 or current_block - last_report_height > 100: ## do not report if there are more than 10 blocks to index
         report_hashes(current_block)
         last_report_height = current_block
     else:
       print("Block %s index failed." % current_block)
-      time.sleep(5)
+      time.sleep(retry_scheduler.failure('index_block'))
   except:
     traceback.print_exc()
-    if in_commit: ## rollback commit if any
-      print("rolling back")
-      cur.execute('''ROLLBACK;''')
-      in_commit = False
-    time.sleep(10)
+    discard_block_changes()
+    time.sleep(retry_scheduler.failure('index_block'))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+In-memory chain tip for OPI-LC indexer
+Holds the hashes of the last indexed blocks so reorg checks, hash chaining and reports do not read them back from the db
+"""
+
+from collections import deque
+
+BLOCK_HEIGHT = 0
+BLOCK_HASH = 1
+BLOCK_EVENT_HASH = 2
+CUMULATIVE_EVENT_HASH = 3
+
+class ChainTip:
+    """
+    The last max_blocks (block_height, block_hash, block_event_hash, cumulative_event_hash) tuples
+    of consecutive indexed blocks, oldest first.
+
+    Entries are appended after a block is committed and rewound after a reorg is committed.
+    """
+
+    def __init__(self, max_blocks):
+        self.entries = deque(maxlen=max_blocks)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self, rows):
+        """Replace the entries with db rows ordered by block_height ascending"""
+        self.entries.clear()
+        for row in rows:
+            self.entries.append(tuple(row))
+
+    def clear(self):
+        self.entries.clear()
+
+    def append(self, block_height, block_hash, block_event_hash, cumulative_event_hash):
+        if len(self.entries) > 0 and self.entries[-1][BLOCK_HEIGHT] != block_height - 1:
+            self.entries.clear() ## not consecutive, start over
+        self.entries.append((block_height, block_hash, block_event_hash, cumulative_event_hash))
+
+    def rewind(self, block_height):
+        """Drop the entries above block_height"""
+        while len(self.entries) > 0 and self.entries[-1][BLOCK_HEIGHT] > block_height:
+            self.entries.pop()
+
+    def get(self, block_height):
+        if len(self.entries) == 0: return None
+        idx = block_height - self.entries[0][BLOCK_HEIGHT]
+        if idx < 0 or idx >= len(self.entries): return None
+        return self.entries[idx]
+
+    def last(self):
+        if len(self.entries) == 0: return None
+        return self.entries[-1]
+
+    def latest(self):
+        """Entries newest first"""
+        return list(reversed(self.entries))
@@ -0,0 +1,18 @@
+CREATE TABLE public.brc20_transfer_outpoints (
+	outpoint text NOT NULL,
+	inscription_id text NOT NULL,
+	inscribed_height int4 NOT NULL,
+	spending_txid text NULL,
+	spent_height int4 NULL,
+	CONSTRAINT brc20_transfer_outpoints_pk PRIMARY KEY (outpoint)
+);
+CREATE INDEX brc20_transfer_outpoints_inscribed_height_idx ON public.brc20_transfer_outpoints USING btree (inscribed_height);
+CREATE INDEX brc20_transfer_outpoints_spent_height_idx ON public.brc20_transfer_outpoints USING btree (spent_height);
+
+CREATE TABLE public.brc20_outpoint_index_block_hashes (
+	id bigserial NOT NULL,
+	block_height int4 NOT NULL,
+	block_hash text NOT NULL,
+	CONSTRAINT brc20_outpoint_index_block_hashes_pk PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX brc20_outpoint_index_block_hashes_block_height_idx ON public.brc20_outpoint_index_block_hashes USING btree (block_height);
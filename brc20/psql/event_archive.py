@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Local event archive for OPI-LC indexer
+Verified blocks are appended as compressed NDJSON records to segment files, an offset index reads any block back without network access
+"""
+
+import os
+import json
+import gzip
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None ## gzip is used when zstandard is not installed
+
+SEGMENT_MAX_BYTES = 256 * 1024 * 1024
+INDEX_FILE = 'index.tsv'
+SEGMENT_PREFIX = 'segment_'
+
+def compress(data, codec):
+    if codec == 'zst':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+def decompress(data, codec):
+    if codec == 'zst':
+        if zstandard is None: raise RuntimeError("zstandard is needed to read .zst archive segments")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+class EventArchive:
+    """
+    Append-only archive of verified blocks.
+
+    Every block is one record {block_height, block_hash, cumulative_event_hash, events}
+    compressed as its own zstd frame or gzip member, so a segment is still a valid
+    compressed NDJSON file and any block can be read back from its offset.
+
+    The index file has a "block_height segment offset length" line per appended block. A line
+    for a height at or below the last archived height (a reorg) drops the entries above it.
+    """
+
+    def __init__(self, path, segment_max_bytes=SEGMENT_MAX_BYTES):
+        self.path = path
+        self.segment_max_bytes = segment_max_bytes
+        self.codec = 'zst' if zstandard is not None else 'gz'
+        self.index = {} ## block_height -> (segment, offset, length)
+        self.max_height = None
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.load_index()
+
+    def __len__(self):
+        return len(self.index)
+
+    def load_index(self):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_path): return
+        with open(index_path) as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 4: continue ## torn last line
+                self.set_index(int(parts[0]), parts[1], int(parts[2]), int(parts[3]))
+
+    def set_index(self, block_height, segment, offset, length):
+        if self.max_height is not None and block_height <= self.max_height:
+            for h in range(block_height, self.max_height + 1):
+                self.index.pop(h, None)
+        self.index[block_height] = (segment, offset, length)
+        self.max_height = block_height
+
+    def last_height(self):
+        return self.max_height
+
+    def current_segment(self):
+        """Last segment if it uses the current codec and has room, a new one otherwise"""
+        segments = sorted([f for f in os.listdir(self.path) if f.startswith(SEGMENT_PREFIX)])
+        if len(segments) > 0:
+            last = segments[-1]
+            if last.endswith('.' + self.codec) and os.path.getsize(os.path.join(self.path, last)) < self.segment_max_bytes:
+                return last
+            seq = int(last[len(SEGMENT_PREFIX):].split('.')[0]) + 1
+        else:
+            seq = 1
+        return SEGMENT_PREFIX + '%06d' % seq + '.ndjson.' + self.codec
+
+    def append(self, block_height, block_hash, cumulative_event_hash, events):
+        record = json.dumps({
+            "block_height": block_height,
+            "block_hash": block_hash,
+            "cumulative_event_hash": cumulative_event_hash,
+            "events": events
+        }, separators=(',', ':')).encode('utf-8') + b'\n'
+        frame = compress(record, self.codec)
+        with self.lock:
+            segment = self.current_segment()
+            with open(os.path.join(self.path, segment), 'ab') as f:
+                offset = f.tell()
+                f.write(frame)
+            ## the index line is written after the data so a crash never indexes a partial frame
+            with open(os.path.join(self.path, INDEX_FILE), 'a') as f:
+                f.write('%d\t%s\t%d\t%d\n' % (block_height, segment, offset, len(frame)))
+            self.set_index(block_height, segment, offset, len(frame))
+
+    def read(self, block_height):
+        """Archived record of block_height or None"""
+        entry = self.index.get(block_height)
+        if entry is None: return None
+        segment, offset, length = entry
+        with open(os.path.join(self.path, segment), 'rb') as f:
+            f.seek(offset)
+            frame = f.read(length)
+        return json.loads(decompress(frame, segment.rsplit('.', 1)[1]))
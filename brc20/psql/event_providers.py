@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Event provider registry for OPI-LC indexer
+Caches each provider's event hash version and indexed height and ranks providers by EWMA latency and error rate
+Event requests are hedged to a second provider when the first one is slower than its p95 latency
+"""
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+EWMA_ALPHA = 0.2
+UNHEALTHY_ERROR_RATE = 0.5 ## providers with a higher error rate are only tried after the healthy ones
+
+HEDGE_PERCENTILE = 0.95
+HEDGE_MIN_SAMPLES = 20 ## below this many latency samples the default hedge delay is used
+HEDGE_DEFAULT_DELAY = 1.0
+HEDGE_MIN_DELAY = 0.05
+
+class ProviderState:
+    __slots__ = ('url', 'event_hash_version', 'event_hash_version_ts', 'block_height', 'block_height_ts',
+                 'latency', 'error_rate', 'requests', 'errors', 'samples')
+
+    def __init__(self, url):
+        self.url = url
+        self.event_hash_version = None
+        self.event_hash_version_ts = 0
+        self.block_height = None
+        self.block_height_ts = 0
+        self.latency = None ## EWMA of successful activity_on_block latency in seconds
+        self.error_rate = 0.0 ## EWMA of failed requests
+        self.requests = 0
+        self.errors = 0
+        self.samples = deque(maxlen=200) ## recent successful activity_on_block latencies
+
+class ProviderRegistry:
+    """
+    Event providers of the OPI network with cached capability checks.
+
+    The event hash version is re-checked every version_ttl seconds. The indexed height is only
+    re-checked when a block above the cached height is requested, at most every height_ttl seconds.
+
+    At most max_inflight activity_on_block requests run at once over all providers, a hedge
+    request is skipped instead of waiting when the limit is reached.
+
+    With a retry_scheduler every provider has a circuit breaker ("provider <url>"), providers
+    with an open circuit are skipped until their next probe.
+    """
+
+    def __init__(self, http_client, usable_event_hash_versions, version_ttl=300, height_ttl=1, max_inflight=8, parse_events=None, retry_scheduler=None):
+        self.http_client = http_client
+        self.retry_scheduler = retry_scheduler
+        self.parse_events = parse_events or (lambda r, block_height: r.json()["result"]) ## (response, block_height) -> events
+        self.usable_event_hash_versions = usable_event_hash_versions
+        self.version_ttl = version_ttl
+        self.height_ttl = height_ttl
+        self.providers = {}
+        self.lock = threading.Lock()
+        self.inflight = threading.BoundedSemaphore(max_inflight)
+        self.executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix='provider')
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def __len__(self):
+        return len(self.providers)
+
+    def set_urls(self, urls):
+        with self.lock:
+            self.providers = {url: self.providers.get(url) or ProviderState(url) for url in urls}
+
+    def breaker(self, provider):
+        if self.retry_scheduler is None: return None
+        return self.retry_scheduler.breaker('provider ' + provider.url)
+
+    def record(self, provider, latency, ok):
+        breaker = self.breaker(provider)
+        if breaker is not None:
+            if ok: breaker.record_success()
+            else: breaker.record_failure()
+        with self.lock:
+            provider.requests += 1
+            if ok:
+                provider.latency = latency if provider.latency is None else provider.latency + EWMA_ALPHA * (latency - provider.latency)
+                provider.samples.append(latency)
+            else:
+                provider.errors += 1
+            provider.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - provider.error_rate)
+
+    def ranked(self):
+        """Providers ordered healthy first, then by EWMA latency, providers without samples are tried first"""
+        with self.lock:
+            providers = list(self.providers.values())
+        return sorted(providers, key=lambda p: (p.error_rate > UNHEALTHY_ERROR_RATE, p.latency if p.latency is not None else 0.0, p.error_rate))
+
+    def get_text(self, provider, path, endpoint, deadline=None):
+        sttm = time.time()
+        timeout = None if deadline is None else self.http_client.deadline_timeout(deadline - sttm)
+        ok = False
+        try:
+            r = self.http_client.get(provider.url + path, endpoint, timeout=timeout)
+            ok = r.status_code == 200
+            return r.text if ok else None
+        except:
+            return None
+        finally:
+            if not ok: self.record(provider, time.time() - sttm, False)
+
+    def check_event_hash_version(self, provider, deadline=None):
+        if provider.event_hash_version is None or time.time() - provider.event_hash_version_ts > self.version_ttl:
+            text = self.get_text(provider, '/v1/brc20/event_hash_version', 'event_hash_version', deadline)
+            if text is None:
+                print("Error getting event hash version from Event Provider")
+                return False
+            try:
+                provider.event_hash_version = int(text)
+            except ValueError:
+                print("Error getting event hash version from Event Provider")
+                return False
+            provider.event_hash_version_ts = time.time()
+        if provider.event_hash_version not in self.usable_event_hash_versions:
+            print("Event provider is using a different Event Hash Version!!")
+            print("Event Provider event hash version: " + str(provider.event_hash_version))
+            print("Usable event hash version: " + str(self.usable_event_hash_versions))
+            return False
+        return True
+
+    def check_block_height(self, provider, block_height, deadline=None):
+        if provider.block_height is not None and provider.block_height >= block_height: return True
+        if time.time() - provider.block_height_ts > self.height_ttl:
+            text = self.get_text(provider, '/v1/brc20/block_height', 'block_height', deadline)
+            if text is None:
+                print("Error getting block height from Event Provider")
+                return False
+            try:
+                provider.block_height = int(text)
+            except ValueError:
+                print("Error getting block height from Event Provider")
+                return False
+            provider.block_height_ts = time.time()
+        if provider.block_height is None or provider.block_height < block_height:
+            print("Block not indexed yet by event provider!!")
+            print("Event Provider block height: " + str(provider.block_height))
+            print("Requested block height: " + str(block_height))
+            return False
+        return True
+
+    def candidates(self, block_height, deadline=None):
+        """Yield ranked providers that use a usable event hash version and have indexed block_height, checked lazily within deadline"""
+        for provider in self.ranked():
+            breaker = self.breaker(provider)
+            if breaker is not None and not breaker.allow(): continue
+            if self.check_event_hash_version(provider, deadline) and self.check_block_height(provider, block_height, deadline):
+                yield provider
+
+    def hedge_delay(self, provider):
+        """Seconds to wait for provider before hedging, its p95 latency once there are enough samples"""
+        with self.lock:
+            samples = sorted(provider.samples)
+        if len(samples) < HEDGE_MIN_SAMPLES: return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, samples[int(HEDGE_PERCENTILE * (len(samples) - 1))])
+
+    def fetch_events(self, provider, block_height, deadline=None):
+        """activity_on_block of a single provider passed through parse_events, None on any error"""
+        sttm = time.time()
+        timeout = None if deadline is None else self.http_client.deadline_timeout(deadline - sttm)
+        try:
+            with self.http_client.get(provider.url + '/v1/brc20/activity_on_block?block_height=' + str(block_height), 'activity_on_block',
+                                      timeout=timeout, stream=True) as r:
+                if r.status_code != 200: raise ValueError("status code " + str(r.status_code))
+                events = self.parse_events(r, block_height)
+            if type(events) is not list: raise ValueError("no result")
+        except Exception as e:
+            print("Error getting events from Event Provider " + provider.url + ": " + str(e))
+            self.record(provider, time.time() - sttm, False)
+            return None
+        self.record(provider, time.time() - sttm, True)
+        return events
+
+    def submit(self, provider, block_height, deadline):
+        """Run fetch_events on the pool, the caller has already acquired an inflight slot"""
+        print("Trying to get events from " + provider.url)
+        future = self.executor.submit(self.fetch_events, provider, block_height, deadline)
+        future.add_done_callback(lambda f: self.inflight.release())
+        return future
+
+    def get_events(self, block_height, timeout=None):
+        """
+        Events of block_height from the best provider, hedged to the next provider after the p95 deadline
+
+        Args:
+            timeout (float): seconds until the answer is given up on, also bounds each request's timeouts
+
+        Returns:
+            list: first valid answer, None if every usable provider failed or the timeout passed
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        candidates = self.candidates(block_height, deadline)
+        pending = {} ## future -> (provider, is_hedge)
+        hedged = False
+        hedge_at = None
+        while True:
+            if len(pending) == 0:
+                if not self.inflight.acquire(timeout=None if deadline is None else max(0.0, deadline - time.time())):
+                    print("No free slot for an events request within %.1fs" % timeout)
+                    return None
+                provider = next(candidates, None)
+                if provider is None:
+                    self.inflight.release()
+                    return None
+                pending[self.submit(provider, block_height, deadline)] = (provider, False)
+                hedge_at = None if hedged else time.time() + self.hedge_delay(provider)
+            wait_until = hedge_at if deadline is None or (hedge_at is not None and hedge_at < deadline) else deadline
+            done, _ = wait(list(pending), timeout=None if wait_until is None else max(0.0, wait_until - time.time()), return_when=FIRST_COMPLETED)
+            if len(done) == 0 and deadline is not None and time.time() >= deadline:
+                print("No events from Event Providers within %.1fs" % timeout)
+                return None ## requests still running release their inflight slots when they finish
+            if len(done) == 0:
+                ## slower than its p95, ask the next provider once unless the concurrency limit is reached
+                hedge_at = None
+                hedged = True
+                if not self.inflight.acquire(blocking=False): continue
+                provider = next(candidates, None)
+                if provider is None:
+                    self.inflight.release()
+                    continue
+                self.hedges += 1
+                pending[self.submit(provider, block_height, deadline)] = (provider, True)
+                continue
+            for future in done:
+                provider, is_hedge = pending.pop(future)
+                events = future.result()
+                if events is not None:
+                    if is_hedge: self.hedge_wins += 1
+                    return events
+
+    def stats(self):
+        with self.lock:
+            providers = list(self.providers.values())
+        return ', '.join(['%s: height %s, latency %s, error rate %.2f, %d requests' %
+                          (p.url, p.block_height, '%.3fs' % p.latency if p.latency is not None else '-', p.error_rate, p.requests)
+                          for p in providers]) + ', %d hedged, %d won by hedge' % (self.hedges, self.hedge_wins)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Typed brc20 event records for OPI-LC indexer
+Each record is parsed once and reused for the brc20_events row, the event hash string and the in-memory caches
+"""
+
+import json
+
+def fix_numstr_decimals(num_str, decimals):
+    if len(num_str) <= 18:
+        num_str = '0' * (18 - len(num_str)) + num_str
+        num_str = '0.' + num_str
+        if decimals < 18:
+            num_str = num_str[:-18+decimals]
+    else:
+        num_str = num_str[:-18] + '.' + num_str[-18:]
+        if decimals < 18:
+            num_str = num_str[:-18+decimals]
+    if num_str[-1] == '.': num_str = num_str[:-1] ## remove trailing dot
+    return num_str
+
+class DeployInscribeEvent:
+    __slots__ = ('inscription_id', 'deployer_pkScript', 'deployer_wallet', 'tick', 'original_tick',
+                 'max_supply', 'decimals', 'limit_per_mint', 'is_self_mint')
+    event_type = 'deploy-inscribe'
+
+    def __init__(self, inscription_id, deployer_pkScript, deployer_wallet, tick, original_tick, max_supply, decimals, limit_per_mint, is_self_mint):
+        self.inscription_id = inscription_id
+        self.deployer_pkScript = deployer_pkScript
+        self.deployer_wallet = deployer_wallet
+        self.tick = tick
+        self.original_tick = original_tick
+        self.max_supply = max_supply
+        self.decimals = decimals
+        self.limit_per_mint = limit_per_mint
+        self.is_self_mint = is_self_mint ## "true" or "false"
+
+    @classmethod
+    def from_db(cls, inscription_id, event):
+        return cls(inscription_id, event["deployer_pkScript"], event["deployer_wallet"], event["tick"], event["original_tick"],
+                   int(event["max_supply"]), int(event["decimals"]), int(event["limit_per_mint"]), event["is_self_mint"])
+
+    def to_json(self):
+        return json.dumps({
+            "deployer_pkScript": self.deployer_pkScript,
+            "deployer_wallet": self.deployer_wallet,
+            "tick": self.tick,
+            "original_tick": self.original_tick,
+            "max_supply": str(self.max_supply),
+            "decimals": str(self.decimals),
+            "limit_per_mint": str(self.limit_per_mint),
+            "is_self_mint": self.is_self_mint
+        })
+
+    def get_event_str(self, decimals):
+        return ("deploy-inscribe;" + self.inscription_id + ";" + self.deployer_pkScript + ";" + self.tick + ";" + self.original_tick + ";" +
+                fix_numstr_decimals(str(self.max_supply), decimals) + ";" + str(self.decimals) + ";" +
+                fix_numstr_decimals(str(self.limit_per_mint), decimals) + ";" + self.is_self_mint)
+
+class MintInscribeEvent:
+    __slots__ = ('inscription_id', 'minted_pkScript', 'minted_wallet', 'tick', 'original_tick', 'amount', 'parent_id')
+    event_type = 'mint-inscribe'
+
+    def __init__(self, inscription_id, minted_pkScript, minted_wallet, tick, original_tick, amount, parent_id):
+        self.inscription_id = inscription_id
+        self.minted_pkScript = minted_pkScript
+        self.minted_wallet = minted_wallet
+        self.tick = tick
+        self.original_tick = original_tick
+        self.amount = amount
+        self.parent_id = parent_id
+
+    @classmethod
+    def from_db(cls, inscription_id, event):
+        return cls(inscription_id, event["minted_pkScript"], event["minted_wallet"], event["tick"], event["original_tick"],
+                   int(event["amount"]), event["parent_id"])
+
+    def to_json(self):
+        return json.dumps({
+            "minted_pkScript": self.minted_pkScript,
+            "minted_wallet": self.minted_wallet,
+            "tick": self.tick,
+            "original_tick": self.original_tick,
+            "amount": str(self.amount),
+            "parent_id": self.parent_id
+        })
+
+    def get_event_str(self, decimals):
+        return ("mint-inscribe;" + self.inscription_id + ";" + self.minted_pkScript + ";" + self.tick + ";" + self.original_tick + ";" +
+                fix_numstr_decimals(str(self.amount), decimals) + ";" + self.parent_id)
+
+class TransferInscribeEvent:
+    __slots__ = ('inscription_id', 'source_pkScript', 'source_wallet', 'tick', 'original_tick', 'amount')
+    event_type = 'transfer-inscribe'
+
+    def __init__(self, inscription_id, source_pkScript, source_wallet, tick, original_tick, amount):
+        self.inscription_id = inscription_id
+        self.source_pkScript = source_pkScript
+        self.source_wallet = source_wallet
+        self.tick = tick
+        self.original_tick = original_tick
+        self.amount = amount
+
+    @classmethod
+    def from_db(cls, inscription_id, event):
+        return cls(inscription_id, event["source_pkScript"], event["source_wallet"], event["tick"], event["original_tick"],
+                   int(event["amount"]))
+
+    def to_json(self):
+        return json.dumps({
+            "source_pkScript": self.source_pkScript,
+            "source_wallet": self.source_wallet,
+            "tick": self.tick,
+            "original_tick": self.original_tick,
+            "amount": str(self.amount)
+        })
+
+    def get_event_str(self, decimals):
+        return ("transfer-inscribe;" + self.inscription_id + ";" + self.source_pkScript + ";" + self.tick + ";" + self.original_tick + ";" +
+                fix_numstr_decimals(str(self.amount), decimals))
+
+class TransferTransferEvent:
+    __slots__ = ('inscription_id', 'source_pkScript', 'source_wallet', 'spent_pkScript', 'spent_wallet', 'tick', 'original_tick',
+                 'amount', 'using_tx_id')
+    event_type = 'transfer-transfer'
+
+    def __init__(self, inscription_id, source_pkScript, source_wallet, spent_pkScript, spent_wallet, tick, original_tick, amount, using_tx_id):
+        self.inscription_id = inscription_id
+        self.source_pkScript = source_pkScript
+        self.source_wallet = source_wallet
+        self.spent_pkScript = spent_pkScript ## None if spent to fee
+        self.spent_wallet = spent_wallet
+        self.tick = tick
+        self.original_tick = original_tick
+        self.amount = amount
+        self.using_tx_id = using_tx_id
+
+    @classmethod
+    def from_db(cls, inscription_id, event):
+        return cls(inscription_id, event["source_pkScript"], event["source_wallet"], event["spent_pkScript"], event["spent_wallet"],
+                   event["tick"], event["original_tick"], int(event["amount"]), event.get("using_tx_id"))
+
+    def to_json(self):
+        return json.dumps({
+            "source_pkScript": self.source_pkScript,
+            "source_wallet": self.source_wallet,
+            "spent_pkScript": self.spent_pkScript,
+            "spent_wallet": self.spent_wallet,
+            "tick": self.tick,
+            "original_tick": self.original_tick,
+            "amount": str(self.amount),
+            "using_tx_id": str(self.using_tx_id)
+        })
+
+    def get_event_str(self, decimals):
+        return ("transfer-transfer;" + self.inscription_id + ";" + self.source_pkScript + ";" +
+                (self.spent_pkScript if self.spent_pkScript is not None else "") + ";" + self.tick + ";" + self.original_tick + ";" +
+                fix_numstr_decimals(str(self.amount), decimals))
+
+EVENT_RECORD_TYPES = {
+    DeployInscribeEvent.event_type: DeployInscribeEvent,
+    MintInscribeEvent.event_type: MintInscribeEvent,
+    TransferInscribeEvent.event_type: TransferInscribeEvent,
+    TransferTransferEvent.event_type: TransferTransferEvent,
+}
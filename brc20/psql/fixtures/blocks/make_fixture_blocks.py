@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Writes the raw block fixtures used by raw_block.py
+
+genesis.bin is the mainnet genesis block. segwit_mix.bin.gz is a deterministic mainnet-sized block:
+P2WPKH and P2TR spends, legacy P2PKH spends, inscription-sized P2TR script path witnesses, batch payouts
+and spends of outputs created earlier in the same block. Txids and the merkle root are computed here from
+the non-witness serialization, independently of the parser.
+
+transfers_*.bin is a short chain with BRC-20 transfer inscriptions and their spends, transfers_3_fork.bin and
+transfers_4_fork.bin replace its last block, see outpoint_index.py.
+"""
+
+import os
+import gzip
+import random
+import hashlib
+
+GENESIS_COINBASE = bytes.fromhex(
+    '04ffff001d0104455468652054696d65732030332f4a616e2f32303039204368616e63656c6c6f72206f6e206272696e6b206f66207365636f6e64206261696c6f757420666f722062616e6b73')
+GENESIS_PUBKEY_SCRIPT = bytes.fromhex(
+    '4104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac')
+GENESIS_HASH = '000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f'
+
+def sha256d(data):
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+def varint(n):
+    if n < 0xfd: return bytes([n])
+    if n <= 0xffff: return b'\xfd' + n.to_bytes(2, 'little')
+    if n <= 0xffffffff: return b'\xfe' + n.to_bytes(4, 'little')
+    return b'\xff' + n.to_bytes(8, 'little')
+
+def push(data):
+    return varint(len(data)) + data
+
+def script_push(data):
+    """Script push opcode for data, unlike push() for witness items and scripts"""
+    if len(data) <= 0x4b: return bytes([len(data)]) + data
+    if len(data) <= 0xff: return b'\x4c' + bytes([len(data)]) + data
+    return b'\x4d' + len(data).to_bytes(2, 'little') + data
+
+def serialize_tx(version, inputs, outputs, locktime, witnesses=None):
+    """inputs are (prevout, script_sig, sequence), outputs (value, script_pubkey), witnesses a list of items per input"""
+    body = varint(len(inputs)) + b''.join(prevout + push(script_sig) + sequence.to_bytes(4, 'little') for prevout, script_sig, sequence in inputs)
+    body += varint(len(outputs)) + b''.join(value.to_bytes(8, 'little') + push(script) for value, script in outputs)
+    stripped = version.to_bytes(4, 'little') + body + locktime.to_bytes(4, 'little')
+    if witnesses is None:
+        return stripped, sha256d(stripped)
+    witness = b''.join(varint(len(items)) + b''.join(push(item) for item in items) for items in witnesses)
+    return version.to_bytes(4, 'little') + b'\x00\x01' + body + witness + locktime.to_bytes(4, 'little'), sha256d(stripped)
+
+def merkle_root(txids):
+    level = list(txids)
+    while len(level) > 1:
+        if len(level) % 2 == 1: level.append(level[-1])
+        level = [sha256d(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0]
+
+def serialize_block(version, prev_hash, timestamp, bits, nonce, txs):
+    header = version.to_bytes(4, 'little') + prev_hash + merkle_root([txid for _, txid in txs]) + \
+             timestamp.to_bytes(4, 'little') + bits.to_bytes(4, 'little') + nonce.to_bytes(4, 'little')
+    return header + varint(len(txs)) + b''.join(raw for raw, _ in txs)
+
+def genesis_block():
+    coinbase = serialize_tx(1, [(b'\x00' * 32 + b'\xff' * 4, GENESIS_COINBASE, 0xffffffff)], [(50 * 10**8, GENESIS_PUBKEY_SCRIPT)], 0)
+    block = serialize_block(1, b'\x00' * 32, 1231006505, 0x1d00ffff, 2083236893, [coinbase])
+    assert sha256d(block[:80])[::-1].hex() == GENESIS_HASH
+    return block
+
+def segwit_mix_block(seed=840000, target_size=1_600_000):
+    rng = random.Random(seed)
+    def rand(n): return rng.randbytes(n)
+    def p2wpkh(): return b'\x00\x14' + rand(20)
+    def p2tr(): return b'\x51\x20' + rand(32)
+    def p2pkh(): return b'\x76\xa9\x14' + rand(20) + b'\x88\xac'
+    def external_prevout(): return rand(32) + rng.randrange(4).to_bytes(4, 'little')
+    def signature(): return rand(rng.choice((71, 72))) ## DER signature with sighash byte
+
+    in_block_outputs = [] ## prevouts created by earlier txs of this block
+    txs = []
+    height_push = push(seed.to_bytes(3, 'little'))
+    coinbase_witness_commitment = b'\x6a\x24\xaa\x21\xa9\xed' + rand(32)
+    txs.append(serialize_tx(2, [(b'\x00' * 32 + b'\xff' * 4, height_push + rand(40), 0xffffffff)],
+                            [(rng.randrange(3 * 10**8, 4 * 10**8), p2wpkh()), (0, coinbase_witness_commitment)], 0, [[b'\x00' * 32]]))
+    size = 80 + 3 + len(txs[0][0])
+    while size < target_size:
+        kind = rng.random()
+        input_count = 1
+        if kind < 0.15: input_count = rng.randint(1, 3)
+        elif kind > 0.9: input_count = rng.randint(1, 2)
+        prevouts = []
+        for _ in range(input_count):
+            if len(in_block_outputs) > 0 and rng.random() < 0.08:
+                prevouts.append(in_block_outputs.pop(rng.randrange(len(in_block_outputs))))
+            else:
+                prevouts.append(external_prevout())
+        sequence = rng.choice((0xffffffff, 0xfffffffd))
+        if kind < 0.15: ## legacy P2PKH
+            inputs = [(prevout, push(signature()) + push(b'\x02' + rand(32)), sequence) for prevout in prevouts]
+            witnesses = None
+            outputs = [(rng.randrange(10**4, 10**8), p2pkh()) for _ in range(2)]
+        elif kind < 0.55: ## P2WPKH
+            inputs = [(prevout, b'', sequence) for prevout in prevouts]
+            witnesses = [[signature(), b'\x02' + rand(32)] for _ in prevouts]
+            outputs = [(rng.randrange(10**4, 10**8), rng.choice((p2wpkh(), p2tr()))) for _ in range(2)]
+        elif kind < 0.8: ## P2TR key path
+            inputs = [(prevout, b'', sequence) for prevout in prevouts]
+            witnesses = [[rand(64)] for _ in prevouts]
+            outputs = [(rng.randrange(10**4, 10**8), p2tr()) for _ in range(rng.randint(1, 2))]
+        elif kind < 0.9: ## P2TR script path with an inscription envelope
+            envelope = b'\x20' + rand(32) + b'\xac\x00\x63\x03ord\x01\x01' + push(b'text/plain;charset=utf-8') + b'\x00' + push(rand(rng.choice((60, 200, 520)))) + b'\x68'
+            inputs = [(prevout, b'', sequence) for prevout in prevouts]
+            witnesses = [[rand(64), envelope, b'\xc1' + rand(32)] for _ in prevouts]
+            outputs = [(546, p2tr())]
+        else: ## batch payout
+            inputs = [(prevout, b'', sequence) for prevout in prevouts]
+            witnesses = [[signature(), b'\x03' + rand(32)] for _ in prevouts]
+            outputs = [(rng.randrange(10**4, 10**7), rng.choice((p2wpkh(), p2tr(), p2pkh()))) for _ in range(rng.randint(10, 60))]
+        raw, txid = serialize_tx(rng.choice((1, 2)), inputs, outputs, rng.choice((0, seed - 1)), witnesses)
+        txs.append((raw, txid))
+        size += len(raw)
+        in_block_outputs.extend(txid + n.to_bytes(4, 'little') for n in range(len(outputs)))
+    return serialize_block(0x20000000, rand(32), 1713571767, 0x17034219, rng.randrange(2**32), txs)
+
+def block_hash(block):
+    return sha256d(block[:80])[::-1].hex()
+
+def transfer_chain(seed=1):
+    """
+    Blocks of the transfers fixture by file name and the outpoints expected in the index
+
+    Returns:
+        tuple: (blocks, expected) where expected maps a chain ('main' or 'fork') to
+               {(txid, vout): (inscription_id, spending txid or None, number of the spending block or None)}
+    """
+    rng = random.Random(seed)
+    def rand(n): return rng.randbytes(n)
+    def p2tr(): return b'\x51\x20' + rand(32)
+    def external_prevout(): return rand(32) + b'\x00' * 4
+    def prevout(txid, vout): return txid + vout.to_bytes(4, 'little')
+    def envelope(content_type, body):
+        chunks = b''.join(script_push(body[i:i + 520]) for i in range(0, len(body), 520))
+        return b'\x00\x63\x03ord' + script_push(b'\x01') + script_push(content_type) + b'\x00' + chunks + b'\x68'
+    def brc20(op, tick, amt):
+        return ('{"p":"brc-20","op":"%s","tick":"%s","amt":"%s"}' % (op, tick, amt)).encode()
+    def reveal(*envelopes):
+        tapscript = script_push(rand(32)) + b'\xac' + b''.join(envelope(b'text/plain;charset=utf-8', body) for body in envelopes)
+        return serialize_tx(2, [(external_prevout(), b'', 0xfffffffd)], [(546, p2tr()) for _ in envelopes],
+                            0, [[rand(64), tapscript, b'\xc0' + rand(32)]])
+    def spend(*prevouts):
+        return serialize_tx(2, [(p, b'', 0xfffffffd) for p in prevouts], [(546, p2tr())], 0, [[rand(64)] for _ in prevouts])
+    def coinbase(height):
+        return serialize_tx(2, [(b'\x00' * 32 + b'\xff' * 4, script_push(height.to_bytes(3, 'little')) + rand(8), 0xffffffff)],
+                            [(625_000_000, p2tr())], 0, [[b'\x00' * 32]])
+    def block(prev, height, txs):
+        return serialize_block(0x20000000, bytes.fromhex(prev)[::-1], 1700000000 + height, 0x207fffff, height, [coinbase(height)] + txs)
+    def inscription_id(txid, index): return txid[::-1].hex() + 'i' + str(index)
+    def outpoint(txid, vout): return (txid[::-1].hex(), vout)
+
+    ## 1: a transfer, a mint and a transfer in one reveal, a text inscription, a plain spend
+    single = reveal(brc20('transfer', 'ordi', '100'))
+    double = reveal(brc20('mint', 'ordi', '1000'), brc20('transfer', 'sats', '5'))
+    text = reveal(b'{"op":"transfer"} but not brc-20')
+    b1 = block(rand(32).hex(), 1, [single, double, text, spend(external_prevout())])
+    ## 2: the single transfer is spent, a transfer is inscribed and spent in the same block, the text inscription moves
+    same_block = reveal(brc20('transfer', 'ordi', '7'))
+    spend_single = spend(external_prevout(), prevout(single[1], 0))
+    spend_same_block = spend(prevout(same_block[1], 0))
+    b2 = block(block_hash(b1), 2, [spend_single, same_block, spend_same_block, spend(prevout(text[1], 0))])
+    ## 3: the second transfer of the double reveal is spent
+    spend_double = spend(prevout(double[1], 1))
+    b3 = block(block_hash(b2), 3, [spend_double])
+    ## 3 and 4 on a fork: a new transfer in 3, the double reveal transfer spent by another tx in 4
+    fork_transfer = reveal(brc20('transfer', 'ordi', '1'))
+    b3_fork = block(block_hash(b2), 3, [fork_transfer])
+    spend_double_fork = spend(prevout(double[1], 1), external_prevout())
+    b4_fork = block(block_hash(b3_fork), 4, [spend_double_fork])
+
+    def txid(tx): return tx[1][::-1].hex()
+    common = {
+        outpoint(single[1], 0): (inscription_id(single[1], 0), txid(spend_single), 2),
+        outpoint(same_block[1], 0): (inscription_id(same_block[1], 0), txid(spend_same_block), 2),
+    }
+    expected = {
+        'main': {**common, outpoint(double[1], 1): (inscription_id(double[1], 1), txid(spend_double), 3)},
+        'fork': {**common, outpoint(double[1], 1): (inscription_id(double[1], 1), txid(spend_double_fork), 4),
+                 outpoint(fork_transfer[1], 0): (inscription_id(fork_transfer[1], 0), None, None)},
+    }
+    blocks = {'transfers_1.bin': b1, 'transfers_2.bin': b2, 'transfers_3.bin': b3,
+              'transfers_3_fork.bin': b3_fork, 'transfers_4_fork.bin': b4_fork}
+    return blocks, expected
+
+if __name__ == "__main__":
+    out_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(out_dir, 'genesis.bin'), 'wb') as f:
+        f.write(genesis_block())
+    with open(os.path.join(out_dir, 'segwit_mix.bin.gz'), 'wb') as f:
+        f.write(gzip.compress(segwit_mix_block(), compresslevel=9, mtime=0))
+    for name, block in transfer_chain()[0].items():
+        with open(os.path.join(out_dir, name), 'wb') as f:
+            f.write(block)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Background hash reporter for OPI-LC indexer
+Reports are sent by a worker thread that retries with backoff, only the latest unsent report is kept
+"""
+
+import os
+import json
+import time
+import threading
+import traceback
+
+class HashReporter:
+    """
+    Sends block hash reports with send(report) -> bool on its own daemon thread.
+
+    submit() never blocks. A report that is still unsent when the next one is submitted is
+    dropped, the latest submitted report wins even if its block height is lower (a reorg).
+    After a failed send the worker waits retry_scheduler.failure(name) seconds before retrying.
+
+    With a state_path the unsent report is kept in that file and sent again after a restart.
+    """
+
+    def __init__(self, send, retry_scheduler, name='report_queue', state_path=None):
+        self.send = send
+        self.retry_scheduler = retry_scheduler
+        self.name = name
+        self.state_path = state_path
+        self.pending = None
+        self.retry_at = 0
+        self.cond = threading.Condition()
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.last_sent_height = None
+        if state_path is not None:
+            self.pending = self.load_state()
+            if self.pending is not None:
+                print("Unsent report for block " + str(self.pending.get("block_height")) + " loaded from " + state_path)
+        self.thread = threading.Thread(target=self.run, name='hash-reporter', daemon=True)
+        self.thread.start()
+
+    def load_state(self):
+        if not os.path.exists(self.state_path): return None
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except ValueError:
+            print("Ignoring unreadable report state " + self.state_path)
+            return None
+
+    def save_state(self, report):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(report, f)
+        os.replace(tmp_path, self.state_path)
+
+    def remove_state(self):
+        try:
+            os.remove(self.state_path)
+        except FileNotFoundError:
+            pass
+
+    def submit(self, report):
+        with self.cond:
+            if self.pending is not None: self.coalesced += 1
+            self.pending = report
+            if self.state_path is not None:
+                try:
+                    self.save_state(report)
+                except OSError:
+                    traceback.print_exc()
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None or time.time() < self.retry_at:
+                    self.cond.wait(None if self.pending is None else self.retry_at - time.time())
+                report = self.pending
+            try:
+                ok = self.send(report)
+            except Exception:
+                traceback.print_exc()
+                ok = False
+            with self.cond:
+                if ok:
+                    self.sent += 1
+                    self.last_sent_height = report.get("block_height")
+                    self.retry_scheduler.success(self.name)
+                    if self.pending is report:
+                        self.pending = None
+                        if self.state_path is not None: self.remove_state()
+                else:
+                    self.failed += 1
+                    self.retry_at = time.time() + self.retry_scheduler.failure(self.name)
+
+    def stats(self):
+        pending = self.pending
+        return '%d sent, %d failed, %d coalesced, last sent %s, pending %s' % (
+            self.sent, self.failed, self.coalesced, self.last_sent_height, '-' if pending is None else pending.get("block_height"))
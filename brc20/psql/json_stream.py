@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Streaming JSON reader for OPI-LC indexer
+Yields the elements of a top level array field one at a time from response chunks, so a whole payload is never held in memory
+"""
+
+import sys
+import json
+import codecs
+
+JSON_WHITESPACE = ' \t\n\r'
+JSON_NUMBER_CHARS = '0123456789.eE+-'
+json_decoder = json.JSONDecoder()
+
+class ChunkReader:
+    """Buffer over an iterable of byte chunks with just enough tokenizing to walk a JSON object"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Append the next chunk to the buffer dropping the consumed part, False at the end of input"""
+        if self.eof: return False
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if text:
+                self.buf = self.buf[self.pos:] + text
+                self.pos = 0
+                return True
+        self.buf = self.buf[self.pos:] + self.decoder.decode(b'', final=True)
+        self.pos = 0
+        self.eof = True
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf): return self.buf[self.pos]
+            if not self.fill(): raise ValueError("unexpected end of JSON")
+
+    def expect(self, ch):
+        if self.peek() != ch: raise ValueError("expected " + ch + " at offset " + str(self.pos))
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value, reading more chunks while it is cut off by the end of the buffer"""
+        self.peek()
+        while True:
+            try:
+                obj, end = json_decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill(): raise
+                continue
+            if not self.eof and type(obj) in (int, float) and all(ch in JSON_NUMBER_CHARS for ch in self.buf[end:]):
+                ## a number may continue in the next chunk, raw_decode also stops before a trailing '.', 'e' or sign
+                self.fill()
+                continue
+            self.pos = end
+            return obj
+
+def iter_json_array(chunks, key):
+    """
+    Yield the elements of the array stored under key in a top level JSON object
+
+    Args:
+        chunks: iterable of bytes, e.g. requests Response.iter_content()
+        key (str): field holding the array, other fields are skipped
+
+    Raises:
+        ValueError: on malformed JSON or when key is missing or not an array
+    """
+    reader = ChunkReader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}': raise ValueError(key + " missing")
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name == key:
+            if reader.peek() != '[':
+                raise ValueError(key + " is " + json.dumps(reader.value()) + ", not an array")
+            reader.expect('[')
+            if reader.peek() == ']': return
+            while True:
+                yield reader.value()
+                ch = reader.peek()
+                reader.pos += 1
+                if ch == ']': return
+                if ch != ',': raise ValueError("malformed array at offset " + str(reader.pos))
+        reader.value()
+        ch = reader.peek()
+        reader.pos += 1
+        if ch == '}': raise ValueError(key + " missing")
+        if ch != ',': raise ValueError("malformed object at offset " + str(reader.pos))
+
+def check_chunk_splits():
+    """Every split of a few payloads into chunks of 1 to 4 bytes yields the same elements as json.loads"""
+    payloads = [b'{"x": 1.5, "result": [1]}', b'{"result": [1,2.5,123]}', b'{"a": -1.5e+10, "result": [-0.25E-3, 7, "\xc3\xa9", true, null]}',
+                b'{"error": null, "result": [{"amount": "5", "n": 10e2}, [1, 2]]}']
+    for payload in payloads:
+        expected = json.loads(payload)["result"]
+        for size in range(1, 5):
+            for offset in range(size):
+                chunks = [payload[:offset]] + [payload[i:i + size] for i in range(offset, len(payload), size)]
+                assert list(iter_json_array(chunks, "result")) == expected, (payload, size, offset)
+    assert list(iter_json_array([b'{"x": 1.', b'5, "result": [1]}'], "result")) == [1]
+    print("chunk splits OK")
+
+# Peak RSS benchmark for development
+def synthetic_block_chunks(count, chunk_size=65536):
+    """JSON of an activity_on_block response with count events, produced chunk by chunk like a socket would"""
+    buf = ['{"error": null, "result": [']
+    size = len(buf[0])
+    for i in range(count):
+        event = json.dumps({"event_type": "transfer-transfer", "inscription_id": "%064xi0" % i, "source_pkScript": "0014" + "%040x" % i,
+                            "spent_pkScript": "5120" + "%064x" % i, "tick": "ordi", "original_tick": "ORDI", "amount": str(5 * 10**18 + i)})
+        if i > 0: event = ',' + event
+        buf.append(event)
+        size += len(event)
+        if size >= chunk_size:
+            yield ''.join(buf).encode('utf-8')
+            buf = []
+            size = 0
+    buf.append(']}')
+    yield ''.join(buf).encode('utf-8')
+
+def benchmark_mode(mode, count):
+    import time
+    import resource
+    from event_validation import validate_block
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sttm = time.time()
+    if mode == 'full':
+        body = b''.join(synthetic_block_chunks(count)) ## what requests holds for r.json()
+        events = json.loads(body)["result"]
+    else:
+        events = iter_json_array(synthetic_block_chunks(count), "result")
+    parsed_events, rejection = validate_block(events, 840000, 837090)
+    elapsed = time.time() - sttm
+    assert rejection is None and len(parsed_events) == count
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{mode:6} {count} events: {elapsed:.2f}s, peak RSS {rss_after / 1024:.0f} MB (+{(rss_after - rss_before) / 1024:.0f} MB)")
+
+def benchmark_peak_rss(count=100000):
+    """Peak RSS of parsing and validating a synthetic block, each mode in its own process"""
+    import subprocess
+    for mode in ('full', 'stream'):
+        subprocess.run([sys.executable, __file__, mode, str(count)], check=True)
+
+if __name__ == "__main__":
+    ## python json_stream.py check  - chunk boundaries inside numbers, strings and literals
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        check_chunk_splits()
+    elif len(sys.argv) > 2:
+        benchmark_mode(sys.argv[1], int(sys.argv[2]))
+    else:
+        benchmark_peak_rss()
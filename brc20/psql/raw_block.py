@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Raw block parser for OPI-LC indexer
+Walks a serialized block (getblock verbosity 0) through a memoryview, finds the transactions spending given prevouts and
+hashes only those into txids, the witness is skipped so segwit txids are correct
+"""
+
+import sys
+import gzip
+import json
+import time
+import hashlib
+from array import array
+
+COINBASE_PREVOUT = b'\x00' * 32 + b'\xff' * 4
+ENVELOPE_MARKER = b'\x00\x63\x03ord' ## OP_FALSE OP_IF "ord"
+OP_ENDIF = 0x68
+
+def sha256d(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part)
+    return hashlib.sha256(h.digest()).digest()
+
+def read_varint(buf, pos):
+    b = buf[pos]
+    if b < 0xfd: return b, pos + 1
+    if b == 0xfd: return buf[pos + 1] | (buf[pos + 2] << 8), pos + 3
+    if b == 0xfe: return int.from_bytes(buf[pos + 1:pos + 5], 'little'), pos + 5
+    return int.from_bytes(buf[pos + 1:pos + 9], 'little'), pos + 9
+
+def read_push(buf, pos):
+    """Data of the script push opcode at pos and the position after it, None for other opcodes"""
+    op = buf[pos]
+    pos += 1
+    if op <= 0x4b: return buf[pos:pos + op], pos + op
+    if op == 0x4c: size, pos = buf[pos], pos + 1
+    elif op == 0x4d: size, pos = int.from_bytes(buf[pos:pos + 2], 'little'), pos + 2
+    elif op == 0x4e: size, pos = int.from_bytes(buf[pos:pos + 4], 'little'), pos + 4
+    elif 0x51 <= op <= 0x60: return bytes([op - 0x50]), pos ## OP_1 .. OP_16
+    else: return None, pos
+    return buf[pos:pos + size], pos + size
+
+def read_envelope(buf, pos, end):
+    """
+    Content type and body of the ord envelope whose fields start at pos
+
+    Returns:
+        tuple: (content_type, body) as bytes, None if the envelope is malformed or runs past end
+    """
+    content_type = None
+    body = []
+    in_body = False
+    while pos < end:
+        if buf[pos] == OP_ENDIF:
+            return content_type, b''.join(body)
+        if in_body:
+            data, pos = read_push(buf, pos)
+            if data is None: return None
+            body.append(data)
+        elif buf[pos] == 0:
+            in_body = True
+            pos += 1
+        else:
+            tag, pos = read_push(buf, pos)
+            if tag is None or pos >= end: return None
+            value, pos = read_push(buf, pos)
+            if value is None: return None
+            if bytes(tag) == b'\x01': content_type = bytes(value)
+    return None
+
+def prevout_key(prev_txid, prev_vout):
+    """36 byte serialized outpoint of a txid in display (reversed) hex and an output index"""
+    return bytes.fromhex(prev_txid)[::-1] + prev_vout.to_bytes(4, 'little')
+
+class RawBlock:
+    """
+    Zero-copy view over a serialized block.
+
+    The constructor only records offsets: where every transaction starts, ends and where its
+    outputs end, and where every input's prevout is. Prevouts are compared as memoryview slices
+    and txids are hashed on demand, for a segwit transaction from the slices around its marker,
+    flag and witness data.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.buf = memoryview(raw)
+        self.tx_starts = array('L') ## offset of the version of each tx
+        self.tx_segwit = array('B')
+        self.tx_outputs_end = array('L') ## offset after the last output, where the witness or locktime starts
+        self.tx_ends = array('L')
+        self.input_offsets = array('L') ## offset of the prevout of each input
+        self.input_txs = array('L') ## tx index of each input
+        self.spenders = None ## prevout memoryview -> tx index, built on the first single lookup
+        self.txid_cache = {}
+        self.parse()
+
+    def parse(self):
+        buf = self.buf
+        tx_count, pos = read_varint(buf, 80)
+        for tx_index in range(tx_count):
+            self.tx_starts.append(pos)
+            pos += 4
+            segwit = buf[pos] == 0 and buf[pos + 1] == 1
+            if segwit: pos += 2
+            input_count, pos = read_varint(buf, pos)
+            for _ in range(input_count):
+                self.input_offsets.append(pos)
+                self.input_txs.append(tx_index)
+                script_len, pos = read_varint(buf, pos + 36)
+                pos += script_len + 4
+            output_count, pos = read_varint(buf, pos)
+            for _ in range(output_count):
+                script_len, pos = read_varint(buf, pos + 8)
+                pos += script_len
+            self.tx_outputs_end.append(pos)
+            if segwit:
+                for _ in range(input_count):
+                    item_count, pos = read_varint(buf, pos)
+                    for _ in range(item_count):
+                        item_len, pos = read_varint(buf, pos)
+                        pos += item_len
+            pos += 4
+            self.tx_segwit.append(segwit)
+            self.tx_ends.append(pos)
+        if pos != len(buf): raise ValueError("block has %d trailing bytes" % (len(buf) - pos))
+
+    def __len__(self):
+        return len(self.tx_starts)
+
+    def block_hash(self):
+        return sha256d(self.buf[:80])[::-1].hex()
+
+    def prev_block_hash(self):
+        return bytes(self.buf[4:36])[::-1].hex()
+
+    def merkle_root(self):
+        """Merkle root of the header, in internal byte order"""
+        return bytes(self.buf[36:68])
+
+    def txid(self, tx_index):
+        txid = self.txid_cache.get(tx_index)
+        if txid is not None: return txid
+        buf = self.buf
+        start = self.tx_starts[tx_index]
+        end = self.tx_ends[tx_index]
+        if self.tx_segwit[tx_index]:
+            ## version, inputs and outputs without marker and flag, then locktime without the witness
+            digest = sha256d(buf[start:start + 4], buf[start + 6:self.tx_outputs_end[tx_index]], buf[end - 4:end])
+        else:
+            digest = sha256d(buf[start:end])
+        txid = digest[::-1].hex()
+        self.txid_cache[tx_index] = txid
+        return txid
+
+    def txids(self):
+        return [self.txid(i) for i in range(len(self))]
+
+    def compute_merkle_root(self):
+        level = [bytes.fromhex(txid)[::-1] for txid in self.txids()]
+        while len(level) > 1:
+            if len(level) % 2 == 1: level.append(level[-1])
+            level = [sha256d(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+        return level[0]
+
+    def envelopes(self, tx_index):
+        """(content_type, body) of every ord envelope in the witness of a transaction, in order"""
+        if not self.tx_segwit[tx_index]: return []
+        raw = self.raw
+        end = self.tx_ends[tx_index] - 4
+        found = []
+        pos = raw.find(ENVELOPE_MARKER, self.tx_outputs_end[tx_index], end)
+        while pos != -1:
+            envelope = read_envelope(self.buf, pos + len(ENVELOPE_MARKER), end)
+            if envelope is not None: found.append(envelope)
+            pos = raw.find(ENVELOPE_MARKER, pos + len(ENVELOPE_MARKER), end)
+        return found
+
+    def find_spending_txids(self, prevouts):
+        """
+        One pass over the inputs for a batch of prevouts
+
+        Args:
+            prevouts: iterable of (prev_txid, prev_vout)
+
+        Returns:
+            dict: (prev_txid, prev_vout) -> spending txid for the prevouts spent in this block
+        """
+        wanted = {prevout_key(prev_txid, prev_vout): (prev_txid, prev_vout) for prev_txid, prev_vout in prevouts}
+        found = {}
+        buf = self.buf
+        input_txs = self.input_txs
+        for i, offset in enumerate(self.input_offsets):
+            prevout = wanted.get(buf[offset:offset + 36])
+            if prevout is not None:
+                found[prevout] = self.txid(input_txs[i])
+                if len(found) == len(wanted): break
+        return found
+
+    def spends_of(self, keys):
+        """(prevout key, spending txid) for every input spending one of a set of 36 byte prevout keys"""
+        buf = self.buf
+        input_txs = self.input_txs
+        found = []
+        for i, offset in enumerate(self.input_offsets):
+            key = buf[offset:offset + 36]
+            if key in keys:
+                found.append((bytes(key), self.txid(input_txs[i])))
+        return found
+
+    def find_spending_txid(self, prev_txid, prev_vout):
+        """Spending txid of a single prevout, None if it is not spent in this block"""
+        if self.spenders is None:
+            buf = self.buf
+            self.spenders = {buf[offset:offset + 36]: tx_index for offset, tx_index in zip(self.input_offsets, self.input_txs)}
+            self.spenders.pop(COINBASE_PREVOUT, None)
+        tx_index = self.spenders.get(prevout_key(prev_txid, prev_vout))
+        return None if tx_index is None else self.txid(tx_index)
+
+# Fixture checks and benchmark against the verbose JSON path, see fixtures/blocks
+def load_fixture(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return gzip.decompress(data) if path.endswith('.gz') else data
+
+def verbose_block(raw_block):
+    """
+    getblock verbosity 2 shaped dict of a raw block with the fields bitcoind returns for inputs and
+    outputs, asm is approximated by the hex
+    """
+    buf = raw_block.buf
+    txs = []
+    for tx_index in range(len(raw_block)):
+        start = raw_block.tx_starts[tx_index]
+        end = raw_block.tx_ends[tx_index]
+        tx_hex = bytes(buf[start:end]).hex()
+        pos = start + (6 if raw_block.tx_segwit[tx_index] else 4)
+        input_count, pos = read_varint(buf, pos)
+        vin = []
+        for _ in range(input_count):
+            prevout = bytes(buf[pos:pos + 36])
+            script_len, pos = read_varint(buf, pos + 36)
+            script = bytes(buf[pos:pos + script_len]).hex()
+            pos += script_len
+            sequence = int.from_bytes(buf[pos:pos + 4], 'little')
+            pos += 4
+            if prevout == COINBASE_PREVOUT:
+                vin.append({"coinbase": script, "sequence": sequence})
+            else:
+                vin.append({"txid": prevout[:32][::-1].hex(), "vout": int.from_bytes(prevout[32:], 'little'),
+                            "scriptSig": {"asm": script, "hex": script}, "sequence": sequence})
+        output_count, pos = read_varint(buf, pos)
+        vout = []
+        for n in range(output_count):
+            value = int.from_bytes(buf[pos:pos + 8], 'little')
+            script_len, pos = read_varint(buf, pos + 8)
+            script = bytes(buf[pos:pos + script_len]).hex()
+            pos += script_len
+            vout.append({"value": value / 1e8, "n": n, "scriptPubKey": {"asm": script, "desc": "raw(" + script + ")#00000000", "hex": script, "type": "unknown"}})
+        if raw_block.tx_segwit[tx_index]:
+            for item in vin:
+                item_count, pos = read_varint(buf, pos)
+                witness = []
+                for _ in range(item_count):
+                    item_len, pos = read_varint(buf, pos)
+                    witness.append(bytes(buf[pos:pos + item_len]).hex())
+                    pos += item_len
+                if item_count > 0: item["txinwitness"] = witness
+        txid = raw_block.txid(tx_index)
+        txs.append({"txid": txid, "hash": sha256d(buf[start:end])[::-1].hex() if raw_block.tx_segwit[tx_index] else txid,
+                    "version": int.from_bytes(buf[start:start + 4], 'little'), "size": end - start, "vsize": end - start, "weight": 4 * (end - start),
+                    "locktime": int.from_bytes(buf[end - 4:end], 'little'), "vin": vin, "vout": vout, "hex": tx_hex})
+    return {"hash": raw_block.block_hash(), "tx": txs}
+
+def json_spending_txid(block, prev_txid, prev_vout):
+    for tx in block['tx']:
+        for vin in tx.get('vin', []):
+            if vin.get('txid') == prev_txid and vin.get('vout') == prev_vout:
+                return tx['txid']
+    return None
+
+def benchmark_fixture(path, lookups=500, rounds=3):
+    import random
+    raw = load_fixture(path)
+    raw_block = RawBlock(raw)
+    assert raw_block.compute_merkle_root() == raw_block.merkle_root(), "merkle root mismatch in " + path
+    block = verbose_block(raw_block)
+    raw_hex = raw.hex() ## getblock verbosity 0 answer
+    json_text = json.dumps(block) ## getblock verbosity 2 answer
+
+    inputs = [(vin['txid'], vin['vout'], tx['txid']) for tx in block['tx'] for vin in tx['vin'] if 'txid' in vin]
+    for prev_txid, prev_vout, txid in inputs: ## every input agrees with the JSON path
+        assert raw_block.find_spending_txid(prev_txid, prev_vout) == txid
+    assert raw_block.find_spending_txids([(i[0], i[1]) for i in inputs]) == {(i[0], i[1]): i[2] for i in inputs}
+    asked = random.Random(1).sample(inputs, min(lookups, len(inputs)))
+    prevouts = [(prev_txid, prev_vout) for prev_txid, prev_vout, _ in asked]
+
+    def best(fn):
+        times = []
+        for _ in range(rounds):
+            sttm = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - sttm)
+        return min(times)
+
+    def json_path():
+        spenders = {}
+        for tx in json.loads(json_text)['tx']:
+            for vin in tx['vin']:
+                if 'txid' in vin: spenders[(vin['txid'], vin['vout'])] = tx['txid']
+        for prevout in prevouts: spenders[prevout]
+    def raw_path():
+        rb = RawBlock(bytes.fromhex(raw_hex))
+        for prev_txid, prev_vout in prevouts: rb.find_spending_txid(prev_txid, prev_vout)
+    def raw_batch_path():
+        RawBlock(bytes.fromhex(raw_hex)).find_spending_txids(prevouts)
+
+    print("%s: %d txs, %d inputs, %.2f MB raw, getblock answer %.2f MB as verbosity 0, %.2f MB as verbosity 2" % (
+        path, len(raw_block), len(inputs), len(raw) / 1e6, len(raw_hex) / 1e6, len(json_text) / 1e6))
+    print("  verbose JSON decode + outpoint map: %.1f ms" % (best(json_path) * 1000))
+    print("  raw parse + %d single lookups:    %.1f ms" % (len(prevouts), best(raw_path) * 1000))
+    print("  raw parse + one batch lookup:      %.1f ms" % (best(raw_batch_path) * 1000))
+
+if __name__ == "__main__":
+    import os
+    fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'blocks')
+    paths = sys.argv[1:] or sorted(os.path.join(fixtures_dir, f) for f in os.listdir(fixtures_dir) if f.endswith(('.bin', '.bin.gz')))
+    for path in paths:
+        benchmark_fixture(path)
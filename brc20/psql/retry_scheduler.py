@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Retry scheduler for OPI-LC indexer
+One backoff policy for every remote call: jittered exponential backoff bounded by a deadline and a circuit breaker per endpoint
+"""
+
+import time
+import random
+import threading
+
+class RetryPolicy:
+    __slots__ = ('attempts', 'deadline', 'base_delay', 'max_delay')
+
+    def __init__(self, attempts=10, deadline=30.0, base_delay=0.5, max_delay=10.0):
+        self.attempts = attempts
+        self.deadline = deadline ## seconds for all attempts together, the remaining time is passed to each attempt
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """Equal jitter backoff, half of base_delay * 2^attempt (capped at max_delay) plus a random part up to the other half"""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures, calls are refused until reset_timeout seconds
+    have passed. Then one probe call is let through every reset_timeout seconds, each failed probe
+    doubles reset_timeout up to max_reset_timeout and a success closes the breaker.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=5.0, max_reset_timeout=120.0):
+        self.failure_threshold = failure_threshold
+        self.initial_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.failures = 0
+        self.retry_at = None ## None while closed
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        return self.retry_at is not None
+
+    def allow(self):
+        with self.lock:
+            if self.retry_at is None: return True
+            if time.time() < self.retry_at: return False
+            self.retry_at = time.time() + self.reset_timeout ## probe, the next one waits another reset_timeout
+            return True
+
+    def retry_after(self):
+        """Seconds until a call is allowed again, 0 when closed"""
+        retry_at = self.retry_at
+        return 0.0 if retry_at is None else max(0.0, retry_at - time.time())
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.retry_at = None
+            self.reset_timeout = self.initial_reset_timeout
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.retry_at is not None:
+                self.reset_timeout = min(self.max_reset_timeout, self.reset_timeout * 2)
+            elif self.failures < self.failure_threshold:
+                return
+            else:
+                self.opened += 1
+            self.retry_at = time.time() + self.reset_timeout
+
+class RetryScheduler:
+    """
+    Policies and circuit breakers by endpoint name, the names used by HttpClient stats.
+
+    run() retries a single call, failure()/success() pace loops that retry a whole step,
+    e.g. the main loop after a failed block.
+    """
+
+    def __init__(self, default_policy=None):
+        self.default_policy = default_policy or RetryPolicy()
+        self.policies = {}
+        self.breakers = {}
+        self.loop_failures = {}
+        self.lock = threading.Lock()
+
+    def set_policy(self, endpoint, policy):
+        self.policies[endpoint] = policy
+
+    def policy(self, endpoint):
+        return self.policies.get(endpoint, self.default_policy)
+
+    def breaker(self, endpoint):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            with self.lock:
+                breaker = self.breakers.setdefault(endpoint, CircuitBreaker())
+        return breaker
+
+    def run(self, endpoint, attempt, breaker=True):
+        """
+        Call attempt(remaining) until it returns something other than None
+
+        Args:
+            endpoint (str): selects the policy and the circuit breaker
+            attempt: function of the seconds left until the deadline, returns None or raises on failure
+            breaker (bool): False for calls whose backends already have their own breakers
+
+        Returns:
+            the first result, None when the attempts or the deadline ran out or the breaker is open
+        """
+        policy = self.policy(endpoint)
+        breaker = self.breaker(endpoint) if breaker else None
+        deadline = time.time() + policy.deadline
+        for n in range(policy.attempts):
+            if breaker is not None and not breaker.allow():
+                print("Circuit open for " + endpoint + ", next try in %.1fs" % breaker.retry_after())
+                return None
+            try:
+                result = attempt(max(0.0, deadline - time.time()))
+            except Exception as e:
+                print("Error on " + endpoint + ": " + str(e))
+                result = None
+            if result is not None:
+                if breaker is not None: breaker.record_success()
+                return result
+            if breaker is not None:
+                breaker.record_failure()
+                if breaker.is_open():
+                    print("Circuit opened for " + endpoint + ", next try in %.1fs" % breaker.retry_after())
+                    return None
+            delay = policy.delay(n)
+            if time.time() + delay >= deadline: break
+            time.sleep(delay)
+        print("Giving up on " + endpoint + " for now")
+        return None
+
+    def failure(self, name):
+        """Count a failed loop step, returns the jittered seconds to wait before retrying it"""
+        with self.lock:
+            failures = self.loop_failures.get(name, 0)
+            self.loop_failures[name] = failures + 1
+        return self.policy(name).delay(failures)
+
+    def success(self, name):
+        self.loop_failures.pop(name, None)
+
+    def stats(self):
+        with self.lock:
+            breakers = sorted(self.breakers.items())
+        opened = [(endpoint, b) for endpoint, b in breakers if b.opened > 0 or b.is_open()]
+        if len(opened) == 0: return 'all circuits closed'
+        return ', '.join(['%s: %s, opened %d times' % (endpoint, 'open for %.1fs' % b.retry_after() if b.is_open() else 'closed', b.opened)
+                          for endpoint, b in opened])